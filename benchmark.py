@@ -0,0 +1,355 @@
+# benchmark.py
+
+"""benchmark.py
+
+The benchmark.py python file provides a benchmark of the methods of the 'iGo.py' module that does not need the network:
+it generates synthetic city graphs of different sizes, with their highways and congestions feeds, and times the
+ingestion of the feeds, the build and refresh of the intelligent graph, the routing and the rendering of maps.
+Results are written in a JSON file so that they can be compared run to run (see '--compare').
+
+Usage: python benchmark.py [--sizes 20 40 80] [--repeat 3] [--queries 20] [--output benchmark.json] [--compare old.json]"""
+
+# authors: Héctor Fortuño and Ramon Ventura
+
+import argparse
+import collections
+import csv
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+import networkx as nx
+import PIL.Image
+from haversine import haversine
+import iGo
+
+CENTER = iGo.Location(2.1700, 41.3870) # Location of the center of the synthetic cities (Barcelona).
+BLOCK = 0.0011 # Degrees between two consecutive intersections of the synthetic cities (about 100 meters).
+MAXSPEEDS = ['30', '50', '50', ['30', '50']] # Values of the 'maxspeed' attribute of the streets, as given by OSMnx.
+WAY_NODES = [3, 4, 5, 6] # Number of intersections of every highway of the synthetic feeds.
+CHANGED_WAYS = 0.2 # Part of the highways whose congestion changes in the refreshed congestions feed.
+IMAGE_SIZE = 1000
+K = 3
+
+# Tuple used to represent the synthetic data of a city of a given size (see 'build_city').
+City = collections.namedtuple('City', 'size graph highways_csv congestions_csv refreshed_congestions_csv')
+
+
+class BlankTileSource:
+    """Class that represents a tile source (see 'iGo.TileCache') that returns the same blank tile for every tile,
+    so that maps are rendered without downloading any map tile."""
+
+    def __init__(self):
+        """Creates the tile source and its blank tile."""
+
+        tile = io.BytesIO()
+        PIL.Image.new('RGB', (256, 256), (242, 239, 233)).save(tile, format='PNG')
+        self.tile = tile.getvalue()
+
+    def get(self, zoom, x, y):
+        """Returns the bytes of the blank tile."""
+
+        return self.tile
+
+
+# Synthetic city
+def synthetic_graph(size, seed=0):
+    """Method that returns a synthetic city graph, as the ones downloaded with 'iGo.download_graph': a directed grid of
+    size x size intersections, slightly moved so that streets are not perfectly straight, whose nodes have 'x' and 'y'
+    coordinates and whose edges have the 'length' (meters), 'maxspeed' and 'name' attributes.
+    Every third street is one-way, alternating its direction, as in the Eixample."""
+
+    rng = random.Random(seed)
+    graph = nx.DiGraph(crs='epsg:4326')
+    start = iGo.Location(CENTER.lng - BLOCK*(size-1)/2, CENTER.lat - BLOCK*(size-1)/2)
+    for i in range(size):
+        for j in range(size):
+            graph.add_node(__node_id(size, i, j), x=start.lng + BLOCK*(i + rng.uniform(-0.1, 0.1)),
+                           y=start.lat + BLOCK*(j + rng.uniform(-0.1, 0.1)))
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size: # Street along the row j.
+                __add_street(graph, rng, __node_id(size, i, j), __node_id(size, i+1, j), f'Carrer {j}', j)
+            if j + 1 < size: # Street along the column i.
+                __add_street(graph, rng, __node_id(size, i, j), __node_id(size, i, j+1), f'Avinguda {i}', i)
+
+    return graph
+
+
+def __node_id(size, i, j):
+    """Private method that returns the OSM node id of the intersection (i, j) of a synthetic city."""
+
+    return 1000000 + i*size + j
+
+
+def __add_street(graph, rng, node_u, node_v, name, street):
+    """Private method that adds to a synthetic graph the edges of the segment of a street between two intersections."""
+
+    location_u = (graph.nodes[node_u]['y'], graph.nodes[node_u]['x'])
+    location_v = (graph.nodes[node_v]['y'], graph.nodes[node_v]['x'])
+    attributes = {'length': haversine(location_u, location_v, unit='m'), 'maxspeed': rng.choice(MAXSPEEDS), 'name': name}
+    if street % 3 != 1 or street % 6 == 1: # Two-way street or one-way street going forward.
+        graph.add_edge(node_u, node_v, **attributes)
+    if street % 3 != 1 or street % 6 == 4: # Two-way street or one-way street going backward.
+        graph.add_edge(node_v, node_u, **attributes)
+
+
+def synthetic_highways(graph, size, seed=0):
+    """Method that returns synthetic highways of a synthetic city graph, as a dictionary such as the one returned by
+    'iGo.download_highways': every highway goes along a row or a column through some consecutive intersections,
+    with its Locations slightly moved away from them. About a third of the segments of the city are covered."""
+
+    rng = random.Random(seed)
+    highways = {}
+    ways = max(1, size*size//6)
+    for way_id in range(1, ways + 1):
+        length = min(rng.choice(WAY_NODES), size)
+        fixed, first = rng.randrange(size), rng.randrange(size - length + 1)
+        if rng.random() < 0.5:
+            nodes = [__node_id(size, first + k, fixed) for k in range(length)]
+        else:
+            nodes = [__node_id(size, fixed, first + k) for k in range(length)]
+        highways[way_id] = [iGo.Location(graph.nodes[node]['x'] + rng.uniform(-0.00005, 0.00005),
+                                         graph.nodes[node]['y'] + rng.uniform(-0.00005, 0.00005)) for node in nodes]
+
+    return highways
+
+
+def synthetic_congestions(highways_list, seed=0, changed=None, date=None):
+    """Method that returns synthetic congestions of synthetic highways, as a dictionary such as the one returned by
+    'iGo.download_congestions'. If other congestions are given as 'changed', only 'CHANGED_WAYS' of their
+    highways get a new congestion, as the ones published by the next refresh of the feed."""
+
+    rng = random.Random(seed)
+    if date == None:
+        date = datetime(2021, 5, 17, 12, 5, 52)
+    congestions = {}
+    for way_id in highways_list:
+        if changed != None and rng.random() >= CHANGED_WAYS:
+            congestions[way_id] = changed[way_id]._replace(date=date)
+        else:
+            congestions[way_id] = iGo.Congestion(rng.choice([0, 1, 1, 2, 2, 3, 4, 5, 6]), rng.choice([0, 1, 2, 3, 4, 5]), date)
+
+    return congestions
+
+
+def write_highways_csv(highways_list, highways_csv):
+    """Method that writes synthetic highways into a csv file with the format of the highways feed of Barcelona
+    (see 'iGo.HIGHWAYS_SCHEMA'), so that it can be read with 'iGo.download_highways'."""
+
+    with open(highways_csv, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=',', quotechar='"')
+        writer.writerow(['Tram', 'Tram_Components', 'Descripció', 'Longitud', 'Latitud'])
+        for way_id, way in highways_list.items():
+            for component, location in enumerate(way, start=1):
+                writer.writerow([way_id, component, f'Via {way_id}, tram sintètic', f'{location.lng:.7f}', f'{location.lat:.7f}'])
+
+
+def write_congestions_csv(congestions_list, congestions_csv):
+    """Method that writes synthetic congestions into a csv file with the format of the congestions feed of Barcelona
+    (see 'iGo.CONGESTIONS_SCHEMA'), so that it can be read with 'iGo.download_congestions'."""
+
+    with open(congestions_csv, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter='#')
+        for way_id, congestion in congestions_list.items():
+            writer.writerow([way_id, congestion.date.strftime('%Y%m%d%H%M%S'), congestion.current, congestion.future])
+
+
+def build_city(size, directory, seed=0):
+    """Method that generates a synthetic city of the given size: its graph and the csv files of its highways,
+    congestions and refreshed congestions, which are saved in the given directory."""
+
+    graph = synthetic_graph(size, seed)
+    highways = synthetic_highways(graph, size, seed)
+    congestions = synthetic_congestions(highways, seed)
+    refreshed_congestions = synthetic_congestions(highways, seed + 1, congestions, datetime(2021, 5, 17, 12, 10, 52))
+    city = City(size, graph, os.path.join(directory, f'highways_{size}.csv'), os.path.join(directory, f'congestions_{size}.csv'),
+                os.path.join(directory, f'congestions_{size}_refreshed.csv'))
+    write_highways_csv(highways, city.highways_csv)
+    write_congestions_csv(congestions, city.congestions_csv)
+    write_congestions_csv(refreshed_congestions, city.refreshed_congestions_csv)
+
+    return city
+
+
+# Timing
+def measure(timings, name, method, *args, repeat=3, setup=None):
+    """Method that runs a method with the given arguments 'repeat' times and saves the seconds taken by every run
+    into the 'timings' dictionary with the given name. If 'setup' is given, it is called before every run (untimed)
+    and its result is given as the first argument of the method. Returns the result of the last run."""
+
+    runs = []
+    for i in range(repeat):
+        first_args = () if setup == None else (setup(),)
+        start = time.perf_counter()
+        result = method(*first_args, *args)
+        runs.append(time.perf_counter() - start)
+    timings[name] = {'min': min(runs), 'median': statistics.median(runs), 'runs': runs}
+    print(f'  {name:<34} {min(runs)*1000:10.2f} ms')
+
+    return result
+
+
+def __run_queries(method, pairs):
+    """Private method that calls a routing method with every pair of origin and destination nodes."""
+
+    for node_origin, node_destination in pairs:
+        method(node_origin, node_destination)
+
+
+def __query_pairs(igraph, queries, seed=0):
+    """Private method that returns random pairs of origin and destination nodes with a path between them."""
+
+    rng = random.Random(seed)
+    nodes = list(igraph.nodes)
+    pairs = []
+    while len(pairs) < queries:
+        node_origin, node_destination = rng.choice(nodes), rng.choice(nodes)
+        if node_origin != node_destination and nx.has_path(igraph, node_origin, node_destination):
+            pairs.append((node_origin, node_destination))
+
+    return pairs
+
+
+def benchmark_city(city, repeat, queries):
+    """Method that times all the stages of the 'iGo' module with a synthetic city and returns the results as a
+    dictionary with the size of the city and the timings of every stage (seconds of every run, 'min' and 'median').
+    Routing timings are the time taken by all the queries, not by every one of them."""
+
+    timings = {}
+
+    # Ingestion of the feeds.
+    highways = measure(timings, 'download_highways', iGo.download_highways, city.highways_csv, repeat=repeat)
+    congestions = measure(timings, 'download_congestions', iGo.download_congestions, city.congestions_csv, repeat=repeat)
+    refreshed_congestions = iGo.download_congestions(city.refreshed_congestions_csv)
+
+    # Indices of the graph.
+    spatial_index = measure(timings, 'build_spatial_index', iGo.build_spatial_index, city.graph, repeat=repeat)
+    snapping_index = measure(timings, 'build_snapping_index', iGo.build_snapping_index, city.graph, highways, spatial_index, repeat=repeat)
+
+    # Build of the intelligent graph, edge by edge and compiled.
+    igraph = measure(timings, 'build_igraph', iGo.build_igraph, highways, congestions, snapping_index,
+                     repeat=repeat, setup=lambda: city.graph.copy())
+    cgraph = measure(timings, 'compile_igraph', iGo.compile_igraph, city.graph, repeat=repeat)
+    measure(timings, 'build_compiled_igraph', iGo.build_compiled_igraph, highways, congestions, snapping_index,
+            repeat=repeat, setup=cgraph.copy)
+    iGo.build_compiled_igraph(cgraph, highways, congestions, snapping_index)
+    igraph = iGo.export_compiled_igraph(cgraph, city.graph.copy())
+
+    # Refresh of the intelligent graph with new congestions.
+    measure(timings, 'update_igraph', iGo.update_igraph, congestions, refreshed_congestions, snapping_index,
+            repeat=repeat, setup=igraph.copy)
+    measure(timings, 'refresh_igraph_copy', iGo.refresh_igraph_copy, igraph, cgraph, highways, refreshed_congestions,
+            snapping_index, repeat=repeat)
+
+    # Single path routing.
+    pairs = __query_pairs(igraph, queries)
+    measure(timings, 'shortest_path_networkx', __run_queries,
+            lambda u, v: iGo.get_shortest_path_with_itime(igraph, u, v, True), pairs, repeat=repeat)
+    measure(timings, 'shortest_path_compiled', __run_queries,
+            lambda u, v: iGo.get_compiled_shortest_path_with_itime(cgraph, u, v, True), pairs, repeat=repeat)
+    measure(timings, 'shortest_path_bidirectional_astar', __run_queries,
+            lambda u, v: iGo.get_compiled_shortest_path_with_itime(cgraph, u, v, True, bidirectional_astar=True), pairs, repeat=repeat)
+    measure(timings, 'time_dependent_shortest_path', __run_queries,
+            lambda u, v: iGo.get_time_dependent_shortest_path(cgraph, u, v), pairs, repeat=repeat)
+
+    # k paths routing.
+    measure(timings, 'k_shortest_paths_networkx', __run_queries,
+            lambda u, v: iGo.get_k_shortest_paths_with_itime(igraph, u, v, K, True), pairs, repeat=repeat)
+    measure(timings, 'alternative_paths_compiled', __run_queries,
+            lambda u, v: iGo.get_alternative_paths_with_itime(cgraph, u, v, K, True), pairs, repeat=repeat)
+    locations = [(iGo.Location(igraph.nodes[u]['x'], igraph.nodes[u]['y']), iGo.Location(igraph.nodes[v]['x'], igraph.nodes[v]['y']))
+                 for u, v in pairs]
+    measure(timings, 'plan_route', __run_queries,
+            lambda origin, destination: iGo.plan_route(igraph, cgraph, origin, destination, K, spatial_index=spatial_index),
+            locations, repeat=repeat)
+
+    # Rendering of maps (encoded in memory, with blank map tiles).
+    measure(timings, 'plot_igraph_congestions', iGo.plot_igraph_congestions, igraph, None, IMAGE_SIZE, True, repeat=repeat)
+    measure(timings, 'plot_compiled_igraph_congestions', iGo.plot_compiled_igraph_congestions, cgraph, None, IMAGE_SIZE, True, repeat=repeat)
+    route = iGo.plan_route(igraph, cgraph, locations[0][0], locations[0][1], K, spatial_index=spatial_index)
+    measure(timings, 'plot_k_ipaths', iGo.plot_k_ipaths, igraph, route.current_path, route.future_path, route.alternative_paths,
+            None, IMAGE_SIZE, 'JPEG', repeat=repeat)
+
+    return {'size': city.size, 'nodes': city.graph.number_of_nodes(), 'edges': city.graph.number_of_edges(),
+            'highways': len(highways), 'queries': queries, 'timings': timings}
+
+
+def compare(results, old_results):
+    """Method that prints the ratio between the minimum time of every stage of two benchmark results
+    (see 'benchmark') for every size benchmarked in both of them."""
+
+    old_sizes = {city['size']: city for city in old_results['cities']}
+    for city in results['cities']:
+        old_city = old_sizes.get(city['size'])
+        if old_city == None:
+            continue
+        print(f'Size {city["size"]} (new / old):')
+        for name, timing in city['timings'].items():
+            if name in old_city['timings']:
+                ratio = timing['min'] / max(old_city['timings'][name]['min'], 1e-9)
+                print(f'  {name:<34} {ratio:6.2f}x{"  <- slower" if ratio > 1.2 else ""}')
+
+
+def benchmark(sizes, repeat, queries, directory):
+    """Method that benchmarks synthetic cities of every given size (see 'benchmark_city'), whose feeds are saved
+    in the given directory, and returns the results with the environment they were got in."""
+
+    iGo.set_tile_cache(iGo.TileCache(BlankTileSource()))
+    cities = []
+    for size in sizes:
+        city = build_city(size, directory)
+        print(f'Size {size}: {city.graph.number_of_nodes()} nodes, {city.graph.number_of_edges()} edges')
+        cities.append(benchmark_city(city, repeat, queries))
+
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'machine': platform.machine(), 'repeat': repeat, 'cities': cities}
+
+
+def __write_markers(directory):
+    """Private method that writes the marker images used by 'iGo.plot_k_ipaths' into the given directory."""
+
+    for filename, color in [('origin.png', (0, 102, 204, 255)), ('destination.png', (204, 0, 0, 255))]:
+        PIL.Image.new('RGBA', (20, 20), color).save(os.path.join(directory, filename))
+
+
+def main():
+    """Method that runs the benchmark with the arguments of the command line and writes its results."""
+
+    parser = argparse.ArgumentParser(description='Benchmark of the iGo module with synthetic cities.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 40, 80], help='intersections of every side of the cities')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every stage')
+    parser.add_argument('--queries', type=int, default=20, help='routing queries of every run')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file where results are written')
+    parser.add_argument('--compare', default=None, help='JSON file with previous results to compare with')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    old_results = None
+    if args.compare != None:
+        with open(args.compare) as file:
+            old_results = json.load(file)
+
+    # Feeds and markers are written into a temporary working directory, as maps look for markers in it.
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        __write_markers(directory)
+        os.chdir(directory)
+        try:
+            results = benchmark(args.sizes, args.repeat, args.queries, directory)
+        finally:
+            os.chdir(working_directory)
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written into {output}.')
+    if old_results != None:
+        compare(results, old_results)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,15 +11,42 @@ getting the shortest path to a desired place of the city."""
 import collections
 from datetime import datetime, date, timedelta
 import iGo
-import os
-import osmnx as ox
-from staticmap import StaticMap, CircleMarker, IconMarker, Line
+import multiprocessing
+from staticmap import IconMarker
+import sys
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 import threading
 
 PLACE = 'Barcelona, Catalonia'
-GRAPH_FILENAME = 'barcelona.graph'
+GRAPH_FILENAME = 'barcelona.igo'
+SPATIAL_INDEX_FILENAME = 'barcelona.spatial'
+SNAPPING_INDEX_FILENAME = 'barcelona.snapping'
+SNAPSHOT_FILENAME = 'barcelona.snapshot'
+GEOCODE_CACHE_FILENAME = 'geocode.json'
+GEOCODE_TTL = 30*24*3600 # Seconds (30 days) a place got from the geocoder is cached.
 SIZE = 1000
+IMAGE_FORMAT = 'JPEG' # Format of the images sent (PNG, or JPEG and WEBP, which are smaller).
+IMAGE_QUALITY = 85 # Quality of JPEG and WEBP images (from 1 to 100).
+ROUTE_CACHE_SIZE = 1024
+RENDER_THREADS = 2 # Maps of routes rendered at once (see 'render_queue').
+RENDER_QUEUE_SIZE = 32 # Maps of routes waiting to be rendered at most.
+MAX_STEPS = 20 # Steps of the directions of a route sent at most.
+REACH_MINUTES = 10 # Minutes of driving of the reachable area shown by default (see 'reach').
+MAX_REACH_MINUTES = 30 # Minutes of driving of the reachable area shown at most.
+REFRESH_SECONDS = 300
+TILES_DIRECTORY = 'tiles'
+# URL template of the tile server of the maps. It needs to allow bulk downloads to prefetch map tiles (see 'prefetch'),
+# so /prefetch is not available with the OpenStreetMap tile server, used by default (if None).
+TILE_URL = None
+# Zoom levels of the tiles prefetched (see 'prefetch'): the ones of all maps rendered by the bot, from the congestions
+# map (13) to the isochrones (up to 'iGo.MAX_ISOCHRONE_ZOOM') and the maps of routes and locations, which StaticMap
+# zooms up to 17.
+TILE_ZOOMS = list(range(12, 18))
+TILE_DISK_SIZE = 16384 # Map tiles kept in the tiles directory (all tiles of the city at 'TILE_ZOOMS' fit in it).
+ADMIN_CHAT_ID = None # Chat id of the administrator of the bot, the only one allowed to prefetch map tiles (if None, nobody).
+# Number of worker processes that find routes (if 0, routes are found by the bot's process). Workers are forked, which
+# Windows can not do and macOS can not do safely, so routes are found by the bot's process there.
+ROUTING_PROCESSES = multiprocessing.cpu_count() if 'fork' in multiprocessing.get_all_start_methods() and sys.platform != 'darwin' else 0
 HIGHWAYS_URL = 'https://opendata-ajuntament.barcelona.cat/data/dataset/1090983a-1c40-4609-8620-14ad49aae3ab/resource/c97072a3-3619-4547-84dd-f1999d2a3fec/download/transit_relacio_trams_format_long.csv'
 CONGESTIONS_URL = 'https://opendata-ajuntament.barcelona.cat/data/dataset/8319c2b1-4c21-4962-9acd-6db4c5ff1148/resource/2d456eb5-4ea6-4f68-9794-2f3f1a58a933/download'
 
@@ -28,86 +55,145 @@ Location = collections.namedtuple('Location', 'lng lat')
 # Tuple used to represent the current and future congestion of a highway.
 Congestion = collections.namedtuple('Congestion', 'actual future')
 
+# Tuple used to represent all the data used by the bot at a given moment. It is replaced at once on every refresh,
+# so a handler that gets it at its beginning always uses consistent data. When the bot starts from a snapshot, there
+# are no networkx graph nor igraph until all data is built (see '__route_igraph').
+State = collections.namedtuple('State', 'graph igraph cgraph spatial_index highways snapping_index congestions congestions_download_datetime congestions_validators congestions_image gazetteer')
+
 # Global variables declaration.
-graph = None
-igraph = None
-highways = None
-congestions = None
-congestions_download_datetime = None
+state = None
+routing_pool = None # Pool of worker processes that find routes (only if ROUTING_PROCESSES > 0).
+route_cache = iGo.RouteCache(ROUTE_CACHE_SIZE) # Routes found with the current congestions.
+geocode_cache = iGo.GeocodeCache(GEOCODE_CACHE_FILENAME, GEOCODE_TTL) # Places got from the geocoder.
+render_queue = None # Maps of routes rendered in the background (started in '__boot', after the routing pool).
+prefetch_lock = threading.Lock() # Held while map tiles are being prefetched.
+snapshot_igraph = None # Compiled igraph of the snapshot and igraph built from it, only if needed (see '__route_igraph').
+snapshot_igraph_lock = threading.Lock()
 
+# Map tiles of all maps are got from a cache in memory and in a directory instead of being downloaded every time.
+tile_source = iGo.HttpTileSource() if TILE_URL == None else iGo.HttpTileSource(TILE_URL)
+tile_cache = iGo.TileCache(tile_source, TILES_DIRECTORY, disk_size=TILE_DISK_SIZE)
+iGo.set_tile_cache(tile_cache)
 
-def __boot():
-    """Private method that boots our bot. The OSMnx graph is downloaded and so
-    are the highways and congestions. Also, the intelligent graph is created."""
 
-    global graph, igraph, highways, congestions, congestions_download_datetime
+def __congestions_image(cgraph):
+    """Private method that plots the real-time congestions of a compiled igraph and returns the bytes of the image,
+    which are kept in memory in the state of the bot to be sent to every user."""
+
+    return iGo.plot_compiled_igraph_congestions(cgraph, None, SIZE, True, IMAGE_FORMAT, IMAGE_QUALITY)
+
 
-    # Get OSMnx graph from Barcelona city. Save it as a global variable.
+def __build():
+    """Private method that builds all the data used by our bot. The OSMnx graph is downloaded and so
+    are the highways and congestions. Also, the intelligent graph is created and a snapshot of it is saved
+    so that the bot can answer as soon as it is restarted (see '__boot')."""
+
+    global state, snapshot_igraph
+
+    # Get OSMnx graph from Barcelona city (saved in the binary format).
     if not iGo.exists_graph(GRAPH_FILENAME):
         graph = iGo.download_graph(PLACE)
-        iGo.save_graph(graph, GRAPH_FILENAME)
+        iGo.save_graph(graph, GRAPH_FILENAME, binary=True)
     else:
         graph = iGo.load_graph(GRAPH_FILENAME)
 
-    # Download Barcelona Highways. Save them as a global variable.
+    # Get the compiled graph (to find paths faster) memory-mapped from the binary file. Its epoch follows the one of the
+    # graph currently used (if any), so routes cached with it are never used with the new congestions.
+    cgraph = iGo.load_compiled_graph(GRAPH_FILENAME)
+    if state != None:
+        cgraph.epoch = max(cgraph.epoch, state.cgraph.epoch)
+
+    # Get the spatial index of the graph (only built if the graph changed).
+    spatial_index = iGo.get_spatial_index(graph, SPATIAL_INDEX_FILENAME)
+
+    # Build the gazetteer of the streets of the graph (to get places without a remote geocoder).
+    gazetteer = iGo.Gazetteer(cgraph)
+
+    # Download Barcelona Highways.
     highways = iGo.download_highways(HIGHWAYS_URL)
 
-    # Download Barcelona Highways' congestions. Save them as a global variable.
-    congestions = iGo.download_congestions(CONGESTIONS_URL)
+    # Get the highways' edges of the graph (only map-matched if graph or highways changed).
+    snapping_index = iGo.get_snapping_index(graph, highways, SNAPPING_INDEX_FILENAME, spatial_index)
 
-    # Set global variable 'congestions_download_datetime' to current datetime.
+    # Download Barcelona Highways' congestions (and their validators, see 'iGo.fetch_congestions') and keep the current datetime.
+    congestions, validators = iGo.fetch_congestions(CONGESTIONS_URL)
     current_datetime = datetime.now()
-    congestions_download_datetime = current_datetime
 
-    # Build the intelligent graph.
-    igraph = iGo.build_igraph(graph, highways, congestions)
+    # Build the intelligent graph with the compiled graph.
+    iGo.build_compiled_igraph(cgraph, highways, congestions, snapping_index)
+    igraph = iGo.export_compiled_igraph(cgraph, graph)
 
-    # Plot and store the real-time congestions.
-    filename = 'congestions.png'
-    iGo.plot_igraph_congestions(igraph, filename, SIZE, current=True)
-    print('Ready to go!')
+    # Plot the real-time congestions and save a snapshot of the intelligent graph.
+    congestions_image = __congestions_image(cgraph)
+    iGo.save_igraph_snapshot(cgraph, congestions, current_datetime, SNAPSHOT_FILENAME)
 
+    # Replace the state of the bot at once (and make the routing workers map the new snapshot).
+    state = State(graph, igraph, cgraph, spatial_index, highways, snapping_index, congestions, current_datetime, validators, congestions_image, gazetteer)
+    snapshot_igraph = None # Routes are plotted with the new igraph.
+    if routing_pool != None:
+        iGo.update_routing_pool(routing_pool)
 
-__boot()
 
+def __refresh_igraph():
+    """Private method that refreshes the data used by re-downloading the real-time
+    congestions and building the igraph with them on a copy of the current one, which replaces it when done.
+    If the congestions have not changed since the last download, nothing is built nor plotted.
+    It is called by the refresh scheduler every 5 minutes (see '__boot')."""
 
-def __need_refresh():
-    """Boolean type private method that returns True if a refresh in our data is needed.
-    Otherwise, returns False."""
+    global state
 
-    # Find the current time.
+    # If the bot started from a snapshot, all data needs to be built first.
+    if state.snapping_index == None:
+        __build()
+        return
+
+    # Download Barcelona Highways' congestions only if they have changed and keep the current datetime.
+    congestions, validators = iGo.fetch_congestions(CONGESTIONS_URL, state.congestions_validators)
     current_datetime = datetime.now()
+    if congestions == None: # Nothing to build nor plot again.
+        state = state._replace(congestions_validators=validators)
+        return
 
-    # Substract the time when the last refresh was done to the current one.
-    difference = current_datetime - congestions_download_datetime
-    seconds = difference.total_seconds()
+    # Build the intelligent graph on a copy (only edges whose congestion has changed are inserted into the igraph).
+    igraph, cgraph = iGo.refresh_igraph_copy(state.igraph, state.cgraph, state.highways, congestions, state.snapping_index)
 
-    # If the difference exceeds a total of 5 minutes, return True. Otherwise, return False.
-    if seconds > 300:
-        return True
-    return False
+    # Plot the real-time congestions and save a snapshot of the intelligent graph.
+    congestions_image = __congestions_image(cgraph)
+    iGo.save_igraph_snapshot(cgraph, congestions, current_datetime, SNAPSHOT_FILENAME)
 
+    # Replace the state of the bot at once (and make the routing workers map the new snapshot).
+    state = state._replace(igraph=igraph, cgraph=cgraph, congestions=congestions, congestions_download_datetime=current_datetime,
+                           congestions_validators=validators, congestions_image=congestions_image)
+    if routing_pool != None:
+        iGo.update_routing_pool(routing_pool)
 
-def __refresh_igraph():
-    """Private method that refreshes the data used by re-downloading the real-time
-    congestions and building again an igraph."""
 
-    global congestions, igraph, congestions_download_datetime
+def __boot():
+    """Private method that boots our bot. If there is a snapshot of the intelligent graph, the bot answers with it
+    while all data is built in the background. Otherwise, all data is built before answering (see '__build').
+    Then, a scheduler refreshes the data every 5 minutes in the background."""
 
-    # Update Barcelona Highways' congestions. Save them as a global variable.
-    congestions = iGo.download_congestions(CONGESTIONS_URL)
+    global state, routing_pool, render_queue
 
-    # Update global variable 'congestions_download_datetime' to current datetime.
-    current_datetime = datetime.now()
-    congestions_download_datetime = current_datetime
+    # Start the routing workers first, as they are forked from this process and no thread can be running yet.
+    if ROUTING_PROCESSES > 0:
+        routing_pool = iGo.start_routing_pool(ROUTING_PROCESSES, SNAPSHOT_FILENAME)
+    render_queue = iGo.RenderQueue(RENDER_THREADS, RENDER_QUEUE_SIZE)
+
+    snapshot = iGo.load_igraph_snapshot(SNAPSHOT_FILENAME)
+    if snapshot == None:
+        __build()
+    else:
+        # Only the memory-mapped compiled igraph is used, no networkx graph is built (see '__route_igraph').
+        cgraph, congestions, congestions_download_datetime = snapshot
+        spatial_index = iGo.get_spatial_index(cgraph, SPATIAL_INDEX_FILENAME)
+        state = State(None, None, cgraph, spatial_index, None, None, congestions, congestions_download_datetime, None,
+                      __congestions_image(cgraph), iGo.Gazetteer(cgraph))
+    iGo.RefreshScheduler(REFRESH_SECONDS, __refresh_igraph, run_now=(snapshot != None)).start()
+    print('Ready to go!')
 
-    # Update the intelligent graph.
-    igraph = iGo.build_igraph(graph, highways, congestions)
 
-    # Plot and store the real-time congestions once updated.
-    filename = 'congestions.png'
-    os.remove(filename)
-    iGo.plot_igraph_congestions(igraph, filename, SIZE, current=True)
+__boot()
 
 
 def start(update, context):
@@ -128,7 +214,9 @@ def help(update, context):
         "- /author: shows the author/s of the project.\n" +
         "- /where: shows a map with your current position.\n" +
         "- /go destination: shows a map with the shortest path from your location to a given destination in Barcelona.\n" +
-        "- /congestions: shows a map with live congestions of Barcelona's driving ways.")
+        "- /congestions: shows a map with live congestions of Barcelona's driving ways.\n" +
+        "- /reach minutes: shows a map with the area you can drive to from your location in the given minutes (10 by default).\n" +
+        "- /prefetch: downloads the map tiles of Barcelona so that maps are shown faster (only for the administrator).")
 
 
 def author(update, context):
@@ -142,16 +230,57 @@ def author(update, context):
 def congestions(update, context):
     """Method that sends the user an image of the real-time congestions in different colors."""
 
-    filename = 'congestions.png'
+    # Image plotted by the refresh scheduler is sent to the user.
+    context.bot.send_photo(
+        chat_id=update.effective_chat.id,
+        photo=state.congestions_image)
 
-    # Checks if the congestions need to be updated.
-    if __need_refresh():
-        __refresh_igraph()
 
-    # Image saved in '__refresh_igraph' method is sent to the user.
-    context.bot.send_photo(
+def __prefetch_tiles(update, context):
+    """Private method that prefetches the map tiles of the city and notifies the user when done (see 'prefetch')."""
+
+    try:
+        cgraph = state.cgraph
+        bounds = (float(cgraph.x.min()), float(cgraph.y.min()), float(cgraph.x.max()), float(cgraph.y.max())) # Bounds of the city.
+        tiles = iGo.prefetch_tiles(tile_cache, bounds, TILE_ZOOMS)
+    finally:
+        prefetch_lock.release()
+    context.bot.send_message(
         chat_id=update.effective_chat.id,
-        photo=open(filename, 'rb'))
+        text=f'{tiles} map tiles prefetched.')
+
+
+def prefetch(update, context):
+    """Method that gets into the map tiles cache all the tiles of the city at the zoom levels used by the bot,
+    so that maps are rendered without waiting for the tile server. Tiles are prefetched in the background.
+    As it downloads thousands of tiles from the tile server, only the administrator of the bot can do it, and only
+    if the tile server allows it (see 'TILE_URL')."""
+
+    # Only the administrator can prefetch map tiles.
+    if ADMIN_CHAT_ID == None or update.effective_chat.id != ADMIN_CHAT_ID:
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='Only the administrator of the bot can prefetch map tiles.')
+        return 0
+
+    # Only from a tile server that allows bulk downloads.
+    if not tile_source.allows_prefetch():
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='The tile server does not allow prefetching map tiles. Set TILE_URL to one that does.')
+        return 0
+
+    # Only one prefetch at a time.
+    if not prefetch_lock.acquire(blocking=False):
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='Map tiles are already being prefetched.')
+        return 0
+
+    context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text='Prefetching map tiles...')
+    threading.Thread(target=__prefetch_tiles, args=(update, context), daemon=True).start()
 
 
 def where(update, context):
@@ -167,27 +296,15 @@ def where(update, context):
 
         lng, lat = context.user_data['location'].lng, context.user_data['location'].lat
 
-        # Check if the user is registered with a username (if not, ask to do so).
-        if update.effective_chat.username == None:
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text='Please set a username to your Telegram account.')
-            return 0
-
-        # Create a png file (unique per user).
-        filename = update.effective_chat.username + '.png'
-
-        # Create a map and place a marker in user's location.
-        map = StaticMap(500, 500)
+        # Create a map and place a marker in user's location (encoded in memory).
+        map = iGo.new_static_map(500, 500)
         map.add_marker(IconMarker((lng, lat), './origin.png', 10, 10))
-        image = map.render()
-        image.save(filename)
+        image = iGo.save_image(map.render(), None, IMAGE_FORMAT, IMAGE_QUALITY)
 
         # Send the image
         context.bot.send_photo(
             chat_id=update.effective_chat.id,
-            photo=open(filename, 'rb'))
-        os.remove(filename)
+            photo=image)
 
         # In order to make sure the user is satisfied, we ask again for the
         # location in case the user didn't update it properly.
@@ -217,7 +334,9 @@ def current_location(update, context):
 
 def __place_to_coordinates(update, context, place):
     """Private method that converts the name of a place into coordinates. Returns
-    a location."""
+    a location, or None if the place is not valid (the user is notified).
+    Street names are found in the gazetteer of the graph, with no network, and other places
+    are got from the geocoder only once (see 'iGo.geocode')."""
 
     try:
         # Checks if the message given by the user are coordinates.
@@ -225,19 +344,16 @@ def __place_to_coordinates(update, context, place):
     except:
         # Execute if the message are not coordinates.
         try:
-            # Check if we are given a valid place.
-            ox.geocoder.geocode(f"{place}, {PLACE}")
+            # Convert the name of the place into coordinates.
+            coordinates = iGo.geocode(place, PLACE, state.gazetteer, geocode_cache)
         except:
+            coordinates = None
+        if coordinates == None:
             # In case we are given something that is not a place or a pair of
             # coordinates, the bot cancels the execution.
             context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text='Not a valid location!')
-            return 0
-
-        # Convert the name of the place into coordinates.
-        geo = ox.geocoder.geocode(f"{place}, {PLACE}")
-        coordinates = (Location)(geo[1], geo[0])
         return coordinates
 
     # Convert string of coordinates into a tuple of floats.
@@ -258,15 +374,68 @@ def __pos(update, context):
     location by sending the name of a place or a pair of coordinates."""
 
     # In case the user sends the name of a place, convert it into coordinates.
-    context.user_data['location'] = __place_to_coordinates(update, context, update.message.text[5:])
+    location = __place_to_coordinates(update, context, update.message.text[5:])
+    if location == None:
+        return 0
+    context.user_data['location'] = location
     context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='Location updated!')
 
 
+def __distance_text(distance):
+    """Private method that returns the text of a distance given in meters."""
+
+    if distance < 1000:
+        return f'{round(distance)} m'
+    return f'{distance/1000:.1f} km'
+
+
+def __directions_text(eta, distance, steps):
+    """Private method that returns the text sent to the user with the ETA, distance and directions of a route
+    (see 'iGo.get_route_directions')."""
+
+    lines = [f'You will arrive in {max(1, round(eta/60))} min ({__distance_text(distance)}).']
+    for number, step in enumerate(steps[:MAX_STEPS], start=1):
+        street = step.street if step.street != None else 'an unnamed road'
+        preposition = 'on' if step.maneuver in ['Head', 'Continue'] else 'onto'
+        lines.append(f'{number}. {step.maneuver} {preposition} {street} for {__distance_text(step.distance)}.')
+    if len(steps) > MAX_STEPS:
+        lines.append(f'... and {len(steps) - MAX_STEPS} more steps.')
+
+    return '\n'.join(lines)
+
+
+def __route_igraph(current_state):
+    """Private method that returns the igraph of the given state, used to plot routes. If the bot started from a snapshot
+    and all data is not built yet, the igraph is built from the compiled igraph the first time a route is plotted,
+    so that the bot does not wait for it to start answering."""
+
+    global snapshot_igraph
+
+    if current_state.igraph != None:
+        return current_state.igraph
+    with snapshot_igraph_lock:
+        if snapshot_igraph == None or snapshot_igraph[0] is not current_state.cgraph:
+            snapshot_igraph = (current_state.cgraph, iGo.export_compiled_igraph(current_state.cgraph))
+        return snapshot_igraph[1]
+
+
+def __send_route_image(update, context, current_state, route):
+    """Private method that plots the map of a route (in memory) and sends it to the user.
+    It is done in the background by the render queue (see 'go')."""
+
+    image = iGo.plot_k_ipaths(__route_igraph(current_state), route.current_path, route.future_path, route.alternative_paths,
+                              None, SIZE, IMAGE_FORMAT, IMAGE_QUALITY)
+    context.bot.send_photo(
+        chat_id=update.effective_chat.id,
+        photo=image)
+
+
 def go(update, context):
-    """Method that sends an image to the user of the 3 shortest paths to the
-    destination specified, highliting the fastest one in color"""
+    """Method that sends the user the ETA, distance and directions of the shortest path to the destination specified
+    as soon as it is found, and then an image of the 3 shortest paths, highliting the fastest one in color,
+    which is rendered in the background"""
 
     destination = update.message.text[4:]
 
@@ -279,6 +448,8 @@ def go(update, context):
 
     # Convert the destination of the user into coordinates.
     destination_coordinates = __place_to_coordinates(update, context, destination)
+    if destination_coordinates == None:
+        return 0
 
     try:
         # Check if a location was already stored.
@@ -292,38 +463,88 @@ def go(update, context):
 
     origin_coordinates = context.user_data['location']
 
-    # Check if our data needs to update.
-    if __need_refresh():
-        __refresh_igraph()
+    # Get the current data, which is refreshed in the background.
+    current_state = state
 
-    try:
-        # Try finding the 3 best paths to the destination.
-        iGo.__get_3_best_ipaths(igraph, origin_coordinates, destination_coordinates)
-    except:
+    # Find the best path and 2 alternative paths to the destination (in a routing worker, if there are).
+    if routing_pool != None:
+        route = iGo.plan_route_in_pool(routing_pool, current_state.cgraph, current_state.spatial_index,
+                                       origin_coordinates, destination_coordinates, cache=route_cache)
+    else:
+        route = iGo.plan_route(current_state.igraph, current_state.cgraph, origin_coordinates, destination_coordinates,
+                               cache=route_cache, spatial_index=current_state.spatial_index)
+    if route.failure != None:
         # If not possible, notify our user that we were unable to find a path.
         context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='Im sorry, I was not able to find a path to your destination.')
         return 0
 
-    # Find the 3 best paths to the destination.
-    best_ipath_current, best_ipath_future, k_ipaths = iGo.__get_3_best_ipaths(igraph, origin_coordinates, destination_coordinates)
+    # Send the user the ETA, distance and directions of the best path at once.
+    distance, steps = iGo.get_route_directions(current_state.cgraph, route)
+    context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=__directions_text(route.eta, distance, steps))
 
-    # Check if the user is registered with a username (if not, ask to do so).
-    if update.effective_chat.username == None:
+    # Plot and send the user the 3 best paths, highliting the best one in color, in the background.
+    if not render_queue.submit(__send_route_image, update, context, current_state, route):
         context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text='Please set a username to your Telegram account.')
-        return 0
+            text='I am drawing too many maps right now, so I can not send you the map of your path.')
+
 
-    filename = update.effective_chat.username + '.png'
+def __send_isochrone_image(update, context, cgraph, isochrone, origin, budget):
+    """Private method that plots the map of the area reachable from the user's location (in memory) and sends it
+    to the user. It is done in the background by the render queue (see 'reach')."""
 
-    # Plot and send the user the 3 best paths, highliting the best one in color.
-    iGo.plot_k_ipaths(igraph, best_ipath_current, best_ipath_future, k_ipaths, filename, SIZE)
+    image = iGo.plot_isochrone(cgraph, isochrone, origin, budget, None, SIZE, IMAGE_FORMAT, IMAGE_QUALITY)
     context.bot.send_photo(
         chat_id=update.effective_chat.id,
-        photo=open(filename, 'rb'))
-    os.remove(filename)
+        photo=image)
+
+
+def reach(update, context):
+    """Method that sends the user how far he can drive from his location in the minutes specified (or in
+    'REACH_MINUTES') and then an image of the reachable area, colored by driving time, which is rendered
+    in the background."""
+
+    # Get the minutes of driving, if given.
+    try:
+        minutes = REACH_MINUTES if len(context.args) == 0 else float(context.args[0])
+    except:
+        minutes = 0
+    if not 1 <= minutes <= MAX_REACH_MINUTES:
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f'Please send me a number of minutes between 1 and {MAX_REACH_MINUTES} and try again.')
+        return 0
+
+    try:
+        # Check if a location was already stored.
+        origin_coordinates = context.user_data['location']
+    except:
+        # If a location wasn't already stored, ask for a location.
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='Please send me your current location and try again.')
+        return 0
+
+    # Get the current data, which is refreshed in the background.
+    current_state = state
+
+    # Find the area reachable within the minutes given and send the user how big it is at once.
+    budget = minutes*60
+    isochrone = iGo.get_isochrone(current_state.cgraph, current_state.spatial_index, origin_coordinates, budget)
+    arrivals, edges = isochrone
+    context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=f'In {minutes:g} min you can reach {len(arrivals)} intersections through {len(edges)} street sections.')
+
+    # Plot and send the user the reachable area in the background.
+    if not render_queue.submit(__send_isochrone_image, update, context, current_state.cgraph, isochrone, origin_coordinates, budget):
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='I am drawing too many maps right now, so I can not send you the map of the area.')
 
 
 # Declares a constant with the access token given in 'token.txt'.
@@ -341,6 +562,8 @@ dispatcher.add_handler(CommandHandler('where', where))
 dispatcher.add_handler(MessageHandler(Filters.location, current_location))
 dispatcher.add_handler(CommandHandler('congestions', congestions))
 dispatcher.add_handler(CommandHandler('go', go))
+dispatcher.add_handler(CommandHandler('reach', reach))
+dispatcher.add_handler(CommandHandler('prefetch', prefetch))
 dispatcher.add_handler(CommandHandler('pos', __pos))
 
 # Starts the bot.
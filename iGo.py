@@ -10,16 +10,43 @@ in a map."""
 # authors: Héctor Fortuño and Ramon Ventura
 
 import collections
+import concurrent.futures
+import multiprocessing
 import osmnx as ox
 import networkx as nx
 from staticmap import StaticMap, CircleMarker, IconMarker, Line
+import PIL.Image
+import PIL.ImageDraw
 import pickle
-import urllib
+import urllib.error
+import urllib.parse
+import urllib.request
+import io
 import csv
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime
+import heapq
+import math
+import difflib
+import bisect
+import time
+import unicodedata
+import re
+import queue
+import threading
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.spatial
 from haversine import haversine
 
 Location = collections.namedtuple('Location', 'lng lat') # Tuple used to represent a location with longitude and latitude coordinates.
-Congestion = collections.namedtuple('Congestion', 'current future') # Tuple used to represent the current and future congestion of a highway.
+Congestion = collections.namedtuple('Congestion', 'current future date', defaults=[None]) # Tuple used to represent the current and future congestion of a highway and when it was published.
+Step = collections.namedtuple('Step', 'maneuver street distance') # Tuple used to represent a step of the directions of a route (see 'get_route_directions').
+Route = collections.namedtuple('Route', 'node_origin node_destination current_path future_path alternative_paths eta failure') # Tuple used to represent the result of a route query (see 'plan_route').
 
 # Open Street Maps Graph
 def exists_graph(graph_filename):
@@ -29,6 +56,8 @@ def exists_graph(graph_filename):
     try: open(graph_filename, 'rb')
     except:
         return False # Graph with graph_filename does not exist.
+    if __is_binary_graph(graph_filename) and __read_binary_header(graph_filename)['version'] != GRAPH_FORMAT_VERSION:
+        return False # Graph saved with another version of the binary format.
     return True
 
 
@@ -44,21 +73,29 @@ def download_graph(place):
     return graph
 
 
-def save_graph(graph, graph_filename):
+def save_graph(graph, graph_filename, binary=False):
     """Method that saves a graph in the current working directory, with filename passed as a parameter,
-    or in a different location if the path is given instead of a single filename."""
+    or in a different location if the path is given instead of a single filename.
+    If binary=True, the graph is compiled and saved in the binary format (see 'save_compiled_graph'), which only
+    keeps node coordinates and edge lengths and maximum speeds but is much faster to load."""
 
+    if binary:
+        save_compiled_graph(compile_igraph(graph), graph_filename)
+        return
     with open(graph_filename, 'wb') as file:
         pickle.dump(graph, file)
 
 
 def load_graph(graph_filename):
     """Method that returns an existing graph in the current working directory or in the location
-    specified by a path given in the filename parameter.
+    specified by a path given in the filename parameter. Both pickled graphs and graphs saved in the binary format
+    are loaded (see 'save_graph').
     Precondition: The graph with given path and filename exists in that location."""
 
     if not exists_graph(graph_filename): #Check the precondition.
         TypeError()
+    if __is_binary_graph(graph_filename):
+        return __compiled_to_graph(load_compiled_graph(graph_filename))
     with open(graph_filename, 'rb') as file:
         graph = pickle.load(file)
 
@@ -71,37 +108,338 @@ def plot_graph(graph, graph_png_filename, size):
 
     ox.plot_graph(graph, node_size=0, figsize=(size,size), show=False, save=True, filepath=graph_png_filename)
 
+# Map tiles
+OSM_TILE_URL = 'https://a.tile.openstreetmap.org/{z}/{x}/{y}.png' # Tile server of OpenStreetMap, used by default.
+USER_AGENT = 'iGo/1.0 (+https://github.com/hectorfortuno2/iGo)' # Sent to tile servers, so that they can contact us.
+
+
+class HttpTileSource:
+    """Class that represents a tile server from which map tiles are downloaded, given the template of their URL."""
+
+    def __init__(self, url_template=OSM_TILE_URL, timeout=10, user_agent=USER_AGENT):
+        """Creates the tile source with the URL template of the tiles, the timeout (seconds) of every request and
+        the User-Agent header sent, which identifies the application."""
+
+        self.url_template = url_template
+        self.timeout = timeout
+        self.user_agent = user_agent
+
+    def get(self, zoom, x, y):
+        """Returns the bytes of the tile, or None if it can not be downloaded."""
+
+        request = urllib.request.Request(self.url_template.format(z=zoom, x=x, y=y), headers={'User-Agent': self.user_agent})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except (urllib.error.URLError, OSError):
+            return None
+
+    def allows_prefetch(self):
+        """Returns whether the tiles can be downloaded in bulk (see 'prefetch_tiles'). The tile usage policy of the
+        OpenStreetMap tile servers forbids it (https://operations.osmfoundation.org/policies/tiles/)."""
+
+        host = urllib.parse.urlsplit(self.url_template).hostname or ''
+        return host != 'tile.openstreetmap.org' and not host.endswith('.tile.openstreetmap.org')
+
+
+class DirectoryTileSource:
+    """Class that represents a directory with map tiles saved as '<directory>/<zoom>/<x>/<y>.png'."""
+
+    def __init__(self, directory):
+        """Creates the tile source with the directory of the tiles."""
+
+        self.directory = directory
+
+    def get(self, zoom, x, y):
+        """Returns the bytes of the tile, or None if there is no such tile."""
+
+        try:
+            with open(os.path.join(self.directory, str(zoom), str(x), f'{y}.png'), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def allows_prefetch(self):
+        """Returns whether the tiles can be got in bulk (see 'prefetch_tiles'), which they always can."""
+
+        return True
+
+
+class TileCache:
+    """Class that represents a cache of the map tiles of a tile source (any object with 'get(zoom, x, y)' and
+    'allows_prefetch()' methods, as HttpTileSource or DirectoryTileSource), so that tiles are not downloaded again
+    every time a map is rendered.
+    The last 'memory_size' tiles used are kept in memory and the last 'disk_size' ones in a directory (if given),
+    where they are kept when the bot is restarted. When a cache is full, the least recently used tile is removed.
+    It can be used by many threads at once."""
+
+    def __init__(self, source, directory=None, memory_size=512, disk_size=8192):
+        """Creates the cache of the tile source. Tiles already saved in the directory are used."""
+
+        self.source = source
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = collections.OrderedDict() # Bytes of the tiles in memory, the most recently used at the end.
+        self.disk = collections.OrderedDict() # Paths of the tiles in the directory, the most recently used at the end.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory != None:
+            paths = [os.path.join(root, filename) for root, dirs, filenames in os.walk(directory) for filename in filenames]
+            for path in sorted(paths, key=os.path.getmtime):
+                self.disk[path] = None
+
+    def get(self, zoom, x, y):
+        """Returns the bytes of the tile, looked for in memory, then in the directory and finally in the tile source.
+        Returns None if the tile source does not have it."""
+
+        key = (zoom, x, y)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        data = None
+        path = None if self.directory == None else os.path.join(self.directory, str(zoom), str(x), f'{y}.png')
+        if path != None and path in self.disk:
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+                os.utime(path) # Recently used, also when the bot is restarted.
+            except OSError: # Removed by another thread.
+                data = None
+        hit = data != None
+        if not hit:
+            data = self.source.get(zoom, x, y)
+            if data == None:
+                return None
+            if path != None:
+                self.__save(path, data)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.memory[key] = data
+            self.memory.move_to_end(key)
+            if len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+            if path != None and path in self.disk:
+                self.disk.move_to_end(path)
+
+        return data
+
+    def __save(self, path, data):
+        """Saves a tile in the directory and removes the least recently used ones if there are too many."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+        with self.lock:
+            self.disk[path] = None
+            self.disk.move_to_end(path)
+            removed = []
+            while len(self.disk) > self.disk_size:
+                removed.append(self.disk.popitem(last=False)[0])
+        for old_path in removed:
+            try: os.remove(old_path)
+            except OSError:
+                pass
+
+
+class CachedStaticMap(StaticMap):
+    """Class that represents a StaticMap whose map tiles are got from a TileCache instead of being downloaded."""
+
+    def __init__(self, width, height, tile_cache):
+        """Creates the map with the given size and the TileCache where its tiles are got from."""
+
+        StaticMap.__init__(self, width, height, url_template='{z}/{x}/{y}')
+        self.tile_cache = tile_cache
+
+    def get(self, url, **kwargs):
+        """Returns the status code and the bytes of the tile of the given URL (see 'url_template'), as StaticMap does."""
+
+        zoom, x, y = [int(value) for value in url.split('/')]
+        data = self.tile_cache.get(zoom, x, y)
+        if data == None:
+            return 404, None
+        return 200, data
+
+
+__tile_cache = None # TileCache used by all maps (see 'set_tile_cache').
+
+
+def set_tile_cache(tile_cache):
+    """Method that sets the TileCache used by all the maps created by this module (see 'new_static_map').
+    If it is None, map tiles are downloaded every time a map is rendered."""
+
+    global __tile_cache
+    __tile_cache = tile_cache
+
+
+def new_static_map(width, height):
+    """Method that returns a new StaticMap with the given size, whose map tiles are got from the TileCache set with
+    'set_tile_cache' (if any)."""
+
+    if __tile_cache == None:
+        return StaticMap(width, height)
+    return CachedStaticMap(width, height, __tile_cache)
+
+
+def tiles_of_bounds(bounds, zoom):
+    """Method that returns the (x, y) numbers of the map tiles of the given zoom that cover the bounds
+    (minimum longitude, minimum latitude, maximum longitude, maximum latitude)."""
+
+    min_lng, min_lat, max_lng, max_lat = bounds
+    min_x, max_x = int(__x_tile(min_lng, zoom)), int(__x_tile(max_lng, zoom))
+    min_y, max_y = int(__y_tile(max_lat, zoom)), int(__y_tile(min_lat, zoom)) # Y tile numbers grow to the south.
+
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def prefetch_tiles(tile_cache, bounds, zooms, threads=4):
+    """Method that gets into the TileCache all the map tiles of the given zooms that cover the bounds
+    (minimum longitude, minimum latitude, maximum longitude, maximum latitude), so that maps of that area are rendered
+    without waiting for the tile server. Returns the number of tiles that could be got.
+    If the tile source of the cache does not allow bulk downloads (see 'HttpTileSource.allows_prefetch'), as the
+    OpenStreetMap tile server, a ValueError is raised and nothing is downloaded."""
+
+    if not tile_cache.source.allows_prefetch():
+        raise ValueError('The tile source does not allow prefetching its tiles.')
+    tiles = [(zoom, x, y) for zoom in zooms for x, y in tiles_of_bounds(bounds, zoom)]
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(lambda tile: tile_cache.get(*tile), tiles))
+
+    return sum(1 for data in results if data != None)
+
+
+# Images
+def save_image(image, image_filename, image_format=None, quality=85):
+    """Method that saves a PIL image (as a rendered map) with the filename (or path) given or, if it is None, returns
+    the bytes of the encoded image, so that it can be sent without writing any file.
+    The format can be 'PNG', or 'JPEG' and 'WEBP', which are smaller, with the given quality (from 1 to 100).
+    If it is not given, it is the one of the filename extension (or PNG if there is no filename)."""
+
+    if image_format == None and image_filename != None:
+        image.save(image_filename)
+        return None
+    if image_format == None:
+        image_format = 'PNG'
+    options = {} if image_format == 'PNG' else {'quality': quality}
+    if image_format == 'JPEG':
+        image = image.convert('RGB') # JPEG has no transparency.
+    if image_filename != None:
+        image.save(image_filename, format=image_format, **options)
+        return None
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+
+    return buffer.getvalue()
+
+
+# Feeds
+def __open_feed(source):
+    """Private method that returns a text stream, read line by line, of a csv feed given by a URL, a file path or a file-like
+    object (binary or text), and whether it has to be closed once read (file-like objects are closed by their owner)."""
+
+    if hasattr(source, 'read'):
+        stream, owned = source, False
+    elif source.startswith('http://') or source.startswith('https://'):
+        stream, owned = urllib.request.urlopen(source), True
+    else:
+        stream, owned = open(source, 'rb'), True
+    if not isinstance(stream, io.TextIOBase): # Bytes are decoded while they are read.
+        stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return stream, owned
+
+
+def __parse_feed_date(value):
+    """Private method that converts a date of the congestions feed (as '20210517120552') into a datetime."""
+
+    return datetime.strptime(value, '%Y%m%d%H%M%S')
+
+
+def __parse_congestion_value(value):
+    """Private method that converts a congestion of the congestions feed into an integer (see 'download_congestions')."""
+
+    congestion = int(value)
+    if congestion < 0 or congestion > 6:
+        raise ValueError(f'congestion {congestion} out of range')
+    return congestion
+
+
+def __parse_way_id(value):
+    """Private method that converts a way_id of a feed into an integer."""
+
+    way_id = int(value)
+    if way_id < 0:
+        raise ValueError(f'negative way_id {way_id}')
+    return way_id
+
+
+# Columns of every row of the feeds, and the method that converts each of them (see 'read_feed').
+HIGHWAYS_SCHEMA = [('way_id', __parse_way_id), ('way_component', int), ('description', str), ('lng', float), ('lat', float)]
+CONGESTIONS_SCHEMA = [('way_id', __parse_way_id), ('date', __parse_feed_date), ('current', __parse_congestion_value), ('future', __parse_congestion_value)]
+
+
+def read_feed(source, schema, delimiter=',', header=False):
+    """Method that reads the rows of a csv feed, given by a URL, a file path or a file-like object, one by one
+    (the feed is never loaded at once) and yields every one of them as a dictionary with the columns of the schema.
+    The schema is a list of pairs of the name of every column and the method that converts it (see 'HIGHWAYS_SCHEMA').
+    Rows with another number of columns or with any value that can not be converted are skipped, and the number of
+    them is printed once the feed is read. If 'header' is True, the first row is skipped too."""
+
+    stream, owned = __open_feed(source)
+    invalid_rows = 0
+    try:
+        reader = csv.reader(stream, delimiter=delimiter, quotechar='"')
+        if header:
+            next(reader, None)
+        for line in reader:
+            if len(line) != len(schema):
+                invalid_rows += 1
+                continue
+            try:
+                row = {name: convert(value) for (name, convert), value in zip(schema, line)}
+            except ValueError: # Value of a column can not be converted.
+                invalid_rows += 1
+                continue
+            yield row
+    finally:
+        if owned:
+            stream.close()
+    if invalid_rows != 0:
+        print(f'Skipped {invalid_rows} invalid rows of the feed.')
+
+
 # Highways
 def download_highways(HIGHWAYS_URL):
     """Specific method created to download the highways of the city of Barcelona.
-    In addition, the function converts the downloaded csv file into a csv.reader to finally put the most important
-    information in a list of lists.
-    The returned list contains in position 'i' the highway with way_id 'i'.
+    The csv feed, which can also be given as a file path or a file-like object, is read row by row (see 'read_feed')
+    to finally put the most important information in a dictionary.
+    The returned dictionary maps every way_id to its highway.
     Each highway is defined as a list of Locations (tuple of longitud and latitude coordinates),
     in which every Location creates a segment of the highway with the following one."""
 
-    highways = [[] for i in range(550)] # Needed defined list to contain all highways. There is extra space in case provided data is increased.
-    with urllib.request.urlopen(HIGHWAYS_URL) as response:
-        lines = [l.decode('utf-8') for l in response.readlines()]
-        reader = csv.reader(lines, delimiter=',', quotechar='"') # Get csv.reader file.
-        next(reader)
-        for line in reader:
-            way_id, way_component, description, lng, lat = line
-            location = (Location) (float(lng), float(lat))
-            highways[int(way_id)].append(location) # Append Location into the position of the list containing the path of its highway.
+    highways = {}
+    for row in read_feed(HIGHWAYS_URL, HIGHWAYS_SCHEMA, delimiter=',', header=True):
+        location = (Location) (row['lng'], row['lat'])
+        highways.setdefault(row['way_id'], []).append(location) # Append Location into the path of its highway.
 
     return highways
 
 
 def plot_highways(highways_list, highways_png_filename, size):
-    """Method that creates a map, using StaticMap library, of some highways passed as a list.
+    """Method that creates a map, using StaticMap library, of some highways passed as a dictionary (see 'download_highways').
     The created map, with defined size, is saved into a location passed as a second parameter.
     Each highway (=way) is defined as a list of Locations (tuple of longitud and latitude coordinates),
     in which every Location creates a segment of the highway with the following one, used to
     draw the lines in the map."""
 
-    m = StaticMap(size, size)
-    for way in highways_list:
+    m = new_static_map(size, size)
+    for way in highways_list.values():
         first = True
         for location in way:
             if not first:
@@ -118,56 +456,313 @@ def plot_highways(highways_list, highways_png_filename, size):
 # Congestions
 def download_congestions(CONGESTIONS_URL):
     """Specific method created to download the congestion of the highways of the city of Barcelona.
-    In addition, the function converts the downloaded csv file into a csv.reader to finally put the most important
-    information in a list.
-    The returned list contains in position 'i' the Congestion of the highway with way_id 'i'.
-    Congestion is a tuple formed by the current congestion and the expected future congestion in 15 minutes time.
+    The csv feed, which can also be given as a file path or a file-like object, is read row by row (see 'read_feed')
+    to finally put the most important information in a dictionary.
+    The returned dictionary maps every way_id to the Congestion of its highway.
+    Congestion is a tuple formed by the current congestion, the expected future congestion in 15 minutes time
+    and the datetime when they were published.
 
     Congestion values: 0 = No info, 1 = Very fluid, 2 = Fluid, 3 = Dense, 4 = Very dense, 5 = Traffic congestion, 6 = Closed way"""
 
-    congestions = [None] * 550 # Needed defined list to contain all Congestions. There is extra space in case provided data is increased.
-    with urllib.request.urlopen(CONGESTIONS_URL) as response:
-        lines = [l.decode('utf-8') for l in response.readlines()]
-        reader = csv.reader(lines, delimiter='#', quotechar='"') # Get csv.reader file.
-        for line in reader:
-            way_id, date, current_value, future_value = line
-            congestion = (Congestion) (int(current_value), int(future_value))
-            congestions[int(way_id)] = congestion # Insert Congestion of the highway with way_id 'i into position 'i' of the list.
+    congestions = {}
+    for row in read_feed(CONGESTIONS_URL, CONGESTIONS_SCHEMA, delimiter='#'):
+        congestion = (Congestion) (row['current'], row['future'], row['date'])
+        congestions[row['way_id']] = congestion # Insert Congestion of the highway with its way_id.
 
     return congestions
 
 
+def congestions_hash(congestions_list):
+    """Method that returns a content hash of the current and future congestion of every highway of a congestions dictionary.
+    Publication dates are not hashed, so congestions published again without changes have the same hash."""
+
+    sha = hashlib.sha1()
+    for way_id in sorted(congestions_list):
+        congestion = congestions_list[way_id]
+        sha.update(f'{way_id},{congestion.current},{congestion.future};'.encode())
+
+    return sha.hexdigest()
+
+
+def fetch_congestions(CONGESTIONS_URL, validators=None):
+    """Method that downloads the congestions (see 'download_congestions') only if they have changed since they were
+    downloaded with the given validators, a dictionary with the 'etag', 'last_modified' and content 'hash'
+    (see 'congestions_hash') of the last download (or None if there was no previous download).
+    The request is conditional (If-None-Match and If-Modified-Since headers), so the feed is not downloaded again if
+    the server has not published a new one, and if it has, its content hash is compared too.
+    Returns the congestions, or None if they have not changed, and the validators of this download, which are the ones
+    to be given next time."""
+
+    if validators == None:
+        validators = {}
+    if not CONGESTIONS_URL.startswith('http://') and not CONGESTIONS_URL.startswith('https://'): # Local feed: only hashed.
+        congestions = download_congestions(CONGESTIONS_URL)
+        new_validators = {'etag': None, 'last_modified': None, 'hash': congestions_hash(congestions)}
+    else:
+        headers = {}
+        if validators.get('etag') != None:
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified') != None:
+            headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(CONGESTIONS_URL, headers=headers))
+        except urllib.error.HTTPError as error:
+            if error.code == 304: # Not modified.
+                return None, validators
+            raise
+        with response:
+            congestions = download_congestions(response)
+            new_validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                              'hash': congestions_hash(congestions)}
+    if new_validators['hash'] == validators.get('hash'): # Published again without changes.
+        return None, new_validators
+
+    return congestions, new_validators
+
+
 def plot_highways_congestions(highways_list, congestions_list, congestions_png, current, size):
-    """Method that plots either the current congestion or the future expected congestion, only of the highways given by a list,
+    """Method that plots either the current congestion or the future expected congestion, only of the highways given by a dictionary,
     in a map created with StaticMap library. If current = True, method will work with with current congestions. Otherwise,
     current = False, it will use the future congestions.
-    Congestions list are also need to be given as a parameter.
+    Congestions dictionary is also need to be given as a parameter.
     The created map, with defined size, is saved into a location passed as a third parameter."""
 
     colors = [None, 'Green', 'Green', 'OrangeRed', 'Red', 'DarkRed', 'Black'] # Used web colors to draw segments depending on highway congestion.
-    m = StaticMap(size, size)
-    way_id = 0
-    for way in highways_list:
+    m = new_static_map(size, size)
+    for way_id, way in highways_list.items():
+        congestion = congestions_list.get(way_id)
         first = True
         for location in way:
             if not first:
                 node_v = location
                 if current: # If desired congestion is the current one.
-                    if congestions_list[way_id] != None and congestions_list[way_id].current != 0: # Highways with no inforamtion are not drawn.
-                        line = Line((node_u, node_v), colors[congestions_list[way_id].current], 2) # Draw line with selected color.
+                    if congestion != None and congestion.current != 0: # Highways with no inforamtion are not drawn.
+                        line = Line((node_u, node_v), colors[congestion.current], 2) # Draw line with selected color.
                         m.add_line(line)
                 else: # If desired congestion is the future one.
-                    if congestions_list[way_id] != None and congestions_list[way_id].future != 0: # Highways with no inforamtion are not drawn.
-                        line = Line((node_u, node_v), colors[congestions_list[way_id].future], 2) # Draw line with selected color.
+                    if congestion != None and congestion.future != 0: # Highways with no inforamtion are not drawn.
+                        line = Line((node_u, node_v), colors[congestion.future], 2) # Draw line with selected color.
                         m.add_line(line)
                 node_u = node_v
             else:
                 node_u = location
                 first = False
-        way_id += 1
     image = m.render()
     image.save(congestions_png)
 
+# Spatial index
+class SpatialIndex:
+    """Class that represents a spatial index of the nodes and edges of a graph, built only once, to find the nearest
+    nodes and edges to many locations at once.
+    Coordinates are projected into meters around the mean latitude of the nodes (enough for a city), and KD-trees
+    of the nodes and of the middle points of the edges are built with scipy."""
+
+    def __init__(self, nodes, x, y, edges):
+        """Creates the spatial index given the OSM ids of the nodes, their coordinates and the edges (pairs of positions
+        of the nodes)."""
+
+        self.nodes = nodes
+        self.edges = edges
+        self.latitude = np.radians(y.mean())
+        self.points = self.project(x, y)
+        self.node_tree = scipy.spatial.cKDTree(self.points)
+        self.edge_tree = scipy.spatial.cKDTree((self.points[edges[:, 0]] + self.points[edges[:, 1]])/2)
+
+    def project(self, lngs, lats):
+        """Method that returns an array with the projected coordinates (meters) of the given longitudes and latitudes."""
+
+        lngs, lats = np.radians(np.asarray(lngs, dtype=np.float64)), np.radians(np.asarray(lats, dtype=np.float64))
+        return np.column_stack((6371008.8*lngs*np.cos(self.latitude), 6371008.8*lats))
+
+    def nearest_nodes(self, lngs, lats):
+        """Method that returns a list with the OSM id of the nearest node to every location given by
+        lists of longitudes and latitudes."""
+
+        if len(lngs) == 0:
+            return []
+        _, positions = self.node_tree.query(self.project(lngs, lats))
+        return self.nodes[positions].tolist()
+
+    def nearest_node(self, location):
+        """Method that returns the OSM id of the nearest node to a Location."""
+
+        return self.nearest_nodes([location.lng], [location.lat])[0]
+
+    def nearest_edges(self, lngs, lats, candidates=8):
+        """Method that returns a list with the nearest edge (pair of OSM ids) to every location given by lists
+        of longitudes and latitudes. The exact distance to the segment of the edge is computed for the
+        'candidates' edges with nearest middle points."""
+
+        if len(lngs) == 0:
+            return []
+        points = self.project(lngs, lats)
+        candidates = min(candidates, len(self.edges))
+        _, positions = self.edge_tree.query(points, k=candidates)
+        positions = positions.reshape(len(points), candidates)
+        start, end = self.points[self.edges[positions, 0]], self.points[self.edges[positions, 1]]
+        segment = end - start
+        squared_length = np.maximum((segment**2).sum(axis=2), 1e-12)
+        projection = np.clip(((points[:, None, :] - start)*segment).sum(axis=2)/squared_length, 0, 1)
+        distances = ((start + projection[:, :, None]*segment - points[:, None, :])**2).sum(axis=2)
+        nearest = positions[np.arange(len(points)), distances.argmin(axis=1)]
+        return [tuple(edge) for edge in self.nodes[self.edges[nearest]].tolist()]
+
+
+def build_spatial_index(graph):
+    """Method that returns the spatial index (see 'SpatialIndex') of the nodes and edges of a graph.
+    The graph can also be a compiled graph (see 'CompiledGraph'), so that no networkx graph is needed."""
+
+    if isinstance(graph, CompiledGraph):
+        edges = np.stack((graph.sources, graph.targets), axis=1).astype(np.int64)
+        spatial_index = SpatialIndex(np.array(graph.nodes, dtype=np.int64), np.array(graph.x), np.array(graph.y), edges)
+        spatial_index.hash = __spatial_hash(graph)
+        return spatial_index
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[node_u], index[node_v]) for node_u, node_v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    x = np.array([graph.nodes[node]['x'] for node in nodes], dtype=np.float64)
+    y = np.array([graph.nodes[node]['y'] for node in nodes], dtype=np.float64)
+    spatial_index = SpatialIndex(np.array(nodes, dtype=np.int64), x, y, edges)
+    spatial_index.hash = __spatial_hash(graph)
+
+    return spatial_index
+
+
+def __spatial_hash(graph):
+    """Private method that returns a content hash of the nodes and edges of a graph, used to know if a saved
+    spatial index belongs to it. A compiled graph has the same hash as the graph it was compiled from.
+    The hash is computed over NumPy arrays of the node ids and coordinates and of the edges, so it is fast to check."""
+
+    if isinstance(graph, CompiledGraph):
+        nodes, x, y = graph.nodes, graph.x, graph.y
+        nodes_u, nodes_v = graph.nodes[graph.sources], graph.nodes[graph.targets]
+    else:
+        nodes = list(graph.nodes)
+        x = [graph.nodes[node]['x'] for node in nodes]
+        y = [graph.nodes[node]['y'] for node in nodes]
+        edges = list(graph.edges())
+        nodes_u, nodes_v = [node_u for node_u, node_v in edges], [node_v for node_u, node_v in edges]
+    sha = hashlib.sha1()
+    for values, dtype in [(nodes, np.int64), (x, np.float64), (y, np.float64), (nodes_u, np.int64), (nodes_v, np.int64)]:
+        sha.update(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    return sha.hexdigest()
+
+
+def get_spatial_index(graph, spatial_index_filename):
+    """Method that returns the spatial index of a graph (or compiled graph) saved with the given filename (or path).
+    If it does not exist or it belongs to another graph, it is built and saved with that filename, alongside the graph."""
+
+    if exists_graph(spatial_index_filename):
+        with open(spatial_index_filename, 'rb') as file:
+            spatial_index = pickle.load(file)
+        if spatial_index.hash == __spatial_hash(graph):
+            return spatial_index
+    spatial_index = build_spatial_index(graph)
+    with open(spatial_index_filename, 'wb') as file:
+        pickle.dump(spatial_index, file)
+
+    return spatial_index
+
+
+# Snapping index
+def __snap_way(graph, way_nodes):
+    """Private method that, given the nearest nodes of the graph to the Locations of a highway, returns the list of edges
+    (pairs of nodes) of the graph that form the highway.
+    The shortest path between two consecutive Locations (now nodes) is found. If there is no path, the other way is tried
+    as data may be given reversed."""
+
+    edges = []
+    first_location = True
+    for node in way_nodes:
+        if not first_location:
+            node_dest = node
+            path = None
+            try: path = ox.distance.shortest_path(graph, node_orig, node_dest, weight = 'length') # Find shortest path between two nodes (Locations).
+            except:
+                pass
+            if path == None: # If not found, try the other way as data may be given reversed.
+                try: path = ox.distance.shortest_path(graph, node_dest, node_orig, weight = 'length')
+                except:
+                    pass # Unable to find any path from u to v or v to u
+            if path != None:
+                edges.extend(zip(path[:-1], path[1:])) # Consecutive nodes of the path are the edges of the segment.
+            node_orig = node_dest
+        else:
+            node_orig = node
+            first_location = False
+
+    return edges
+
+
+def __snapping_hash(graph, highways_list):
+    """Private method that returns a content hash of a graph and a dictionary of highways. It identifies the version
+    of the data used to build a snapping index, so that the index is rebuilt when any of them changes."""
+
+    sha = hashlib.sha1()
+    for node_u, node_v in graph.edges():
+        sha.update(f'{node_u},{node_v};'.encode())
+    sha.update(repr(highways_list).encode())
+
+    return sha.hexdigest()
+
+
+def build_snapping_index(graph, highways_list, spatial_index=None):
+    """Method that map-matches every highway of the dictionary into the graph once and returns the snapping index.
+    The snapping index is a dictionary with the content 'hash' of the graph and highways used (see '__snapping_hash')
+    and the 'edges' of every highway: a dictionary that maps every way_id to the list of edges (pairs of nodes)
+    of the graph that form the highway.
+    As highways geometry does not change, the index can be reused by 'build_igraph' every time congestions are refreshed.
+    The nearest nodes of all Locations of all highways are looked for at once with the spatial index of the graph
+    (see 'build_spatial_index'), which is built if it is not given."""
+
+    if spatial_index == None:
+        spatial_index = build_spatial_index(graph)
+    locations = [location for way in highways_list.values() for location in way]
+    nodes = spatial_index.nearest_nodes([location.lng for location in locations], [location.lat for location in locations])
+    edges = {}
+    first = 0
+    for way_id, way in highways_list.items():
+        if len(way) != 0: # Only highways with some Location are snapped.
+            edges[way_id] = __snap_way(graph, nodes[first:first+len(way)])
+        first += len(way)
+
+    return {'hash': __snapping_hash(graph, highways_list), 'edges': edges}
+
+
+def save_snapping_index(snapping_index, snapping_index_filename):
+    """Method that saves a snapping index with the filename (or path) passed as a parameter."""
+
+    with open(snapping_index_filename, 'wb') as file:
+        pickle.dump(snapping_index, file)
+
+
+def load_snapping_index(snapping_index_filename, graph, highways_list):
+    """Method that returns the snapping index saved with the given filename (or path) if it was built from
+    the same graph and highways given as parameters. Otherwise, or if the file does not exist, returns None."""
+
+    if not exists_graph(snapping_index_filename):
+        return None
+    with open(snapping_index_filename, 'rb') as file:
+        snapping_index = pickle.load(file)
+    if snapping_index['hash'] != __snapping_hash(graph, highways_list): # Graph or highways have changed.
+        return None
+
+    return snapping_index
+
+
+def get_snapping_index(graph, highways_list, snapping_index_filename, spatial_index=None):
+    """Method that returns the saved snapping index of the graph and highways given. If there is no valid saved
+    snapping index, it is built (with the spatial index of the graph, if given) and saved with the filename
+    (or path) passed as a parameter."""
+
+    snapping_index = load_snapping_index(snapping_index_filename, graph, highways_list)
+    if snapping_index == None:
+        snapping_index = build_snapping_index(graph, highways_list, spatial_index)
+        save_snapping_index(snapping_index, snapping_index_filename)
+
+    return snapping_index
+
 # iGraph
 def __compare_edge_congestion(graph, node_u, node_v, edge_congestion, key):
     """Auxilliary private function that looks for a congestion between two nodes and,
@@ -216,6 +811,21 @@ def __get_near_congestion(graph, node_u, node_v, current):
     return edge_congestion
 
 
+def __parse_maxspeed(maxspeed):
+    """Private method that returns, in meters/second, the maximum speed given by the 'maxspeed' attribute
+    of an edge (in km/h). If a list of speeds is given, the lowest one is returned."""
+
+    if isinstance(maxspeed, str): # Single speed found.
+        return (float(maxspeed)*10)/36 # Speed in meters/second.
+    max_speed = float('inf') # A list of speeds is found. Get the lowest one.
+    for speed in maxspeed:
+        ms_speed = (float(speed)*10)/36 # Speed in meters/second.
+        if ms_speed < max_speed:
+            max_speed = ms_speed
+
+    return max_speed
+
+
 def __define_edge_attributes(graph, node_u, node_v, congestion, current):
     """Private method that defines and returns the values of the maximum speed, the length and
     the current/future congestion of an edge between two given nodes of a graph.
@@ -229,14 +839,7 @@ def __define_edge_attributes(graph, node_u, node_v, congestion, current):
     try: graph[node_u][node_v]['maxspeed']
     except: # Edge does not have a defined maximum speed.
         graph[node_u][node_v]['maxspeed'] = '30'
-    if isinstance(graph[node_u][node_v]['maxspeed'], str): # Single speed found.
-        max_speed = (float(graph[node_u][node_v]['maxspeed'])*10)/36 # Speed in meters/second.
-    else: # A list of speeds is found. Get the lowest one.
-        max_speed = float('inf')
-        for speed in graph[node_u][node_v]['maxspeed']:
-            ms_speed = (float(speed)*10)/36 # Speed in meters/second.
-            if ms_speed < max_speed:
-                max_speed = ms_speed
+    max_speed = __parse_maxspeed(graph[node_u][node_v]['maxspeed'])
     # Length
     try: graph[node_u][node_v]['length']
     except: # Edge does not have a defined length.
@@ -256,13 +859,9 @@ def __define_edge_attributes(graph, node_u, node_v, congestion, current):
     return max_speed, length, congestion
 
 
-def __expand_congestion_info(graph, way, way_congestion, current):
-    """Private method that, given a highway with his current/future congestion information,
-    inserts that congestion in every edge of the graph belonging to the highway and creates adds the 'itime'
-    attribute to every edge, too.
-    As highways are given as a list of Locations, the nearest node of the graph for each Location is searched, and then
-    the shortest path between two consecutive Loctions (now nodes) is found in order to insert the congestion and the 'itime'
-    to all paths of the OSMnx graph that form a highway.
+def __set_edge_itime(graph, node_u, node_v, congestion, current):
+    """Private method that defines the edge attributes of the edge between nodes 'u' and 'v' with the given
+    current/future congestion (or a near one if it is None) and inserts its current/future 'itime'.
     The 'itime' attribute is defined as the time (seconds) to go through a way with defined 'length' and being able to
     reach a determined percentage of the 'maxspeed' depending on the congestion.
     Speed percentage: Congestion = 1 --> 100% speed, Congestion = 2 --> 85% speed, Congestion = 3 --> 60% speed
@@ -273,58 +872,9 @@ def __expand_congestion_info(graph, way, way_congestion, current):
         key = 'current_itime'
     else:
         key = 'future_itime'
-    first_location = True
-    for location in way:
-        if not first_location:
-            node_dest = ox.distance.nearest_nodes(graph, location.lng, location.lat) # Look for the nearest node in the OSMnx graph of a Location.
-            path = []
-            try: path = ox.distance.shortest_path(graph, node_orig, node_dest, weight = 'length') # Find shortest path between two nodes (Locations).
-            except: # If not found, try the other way as data may be given reversed.
-                try:
-                    path = ox.distance.shortest_path(graph, node_dest, node_orig, weight = 'length')
-                except:
-                    pass # Unable to find any path from u to v or v to u
-            first_node = True
-            for node in path: # For every node that forms the path in the graph representing a segment of the highway:
-                if not first_node:
-                    node_v = node
-                    # Define attributes
-                    edge_max_speed, edge_length, edge_congestion = __define_edge_attributes(graph, node_u, node_v, way_congestion, current)
-                    # Create itime
-                    if edge_congestion == 6:
-                        itime = float('inf') # Closed road
-                    else:
-                        percentage = speed_percentage_based_on_congestion[edge_congestion]
-                        itime = edge_length/(percentage*edge_max_speed) # Definition of itime.
-                    graph[node_u][node_v][key] = itime
-                    node_u = node_v
-                else:
-                    node_u = node
-                    first_node = False
-            node_orig = node_dest
-        else:
-            node_orig = ox.distance.nearest_nodes(graph, location.lng, location.lat) # Look for the nearest node in the OSMnx graph of a Location.
-            first_location = False
-
-
-def __complete_itime(graph, node_u, node_v, current):
-    """Auxilliary private method to the '__complete_igraph_without_congestion' function that,
-    given an edge from nodes 'u' to 'v' of a graph, defines the edge attributes, including current/future congestion,
-    and the current/future itime of it.
-    If current=True, method will look for current itime and congestion. Otherwise will do the same but for the future attributes.
-    The 'itime' attribute is defined as the time (seconds) to go through a way with defined 'length' and being able to
-    reach a determined percentage of the 'maxspeed' depending on the congestion.
-    Speed percentage: Congestion = 1 --> 100% speed, Congestion = 2 --> 85% speed, Congestion = 3 --> 60% speed
-                      Congestion = 4 --> 40% speed, Congestion = 5 --> 20% speed."""
-
-    speed_percentage_based_on_congestion = [None, 1, 0.85, 0.6, 0.4, 0.2, float('inf')]
-    if current:
-        key = 'current_itime'
-    else:
-        key = 'future_itime'
-    # Define Edge attributes
-    edge_max_speed, edge_length, edge_congestion = __define_edge_attributes(graph, node_u, node_v, None, current)
-    # Create current/future itime
+    # Define attributes
+    edge_max_speed, edge_length, edge_congestion = __define_edge_attributes(graph, node_u, node_v, congestion, current)
+    # Create itime
     if edge_congestion == 6:
         itime = float('inf') # Closed road
     else:
@@ -333,6 +883,24 @@ def __complete_itime(graph, node_u, node_v, current):
     graph[node_u][node_v][key] = itime
 
 
+def __expand_congestion_info(graph, way_edges, way_congestion, current):
+    """Private method that, given the edges of the graph that form a highway (see '__snap_way') with his current/future
+    congestion information, inserts that congestion in every edge of the highway and adds the 'itime' attribute
+    to every edge, too."""
+
+    for node_u, node_v in way_edges:
+        __set_edge_itime(graph, node_u, node_v, way_congestion, current)
+
+
+def __complete_itime(graph, node_u, node_v, current):
+    """Auxilliary private method to the '__complete_igraph_without_congestion' function that,
+    given an edge from nodes 'u' to 'v' of a graph, defines the edge attributes, including current/future congestion,
+    and the current/future itime of it, looking at near edges congestions.
+    If current=True, method will look for current itime and congestion. Otherwise will do the same but for the future attributes."""
+
+    __set_edge_itime(graph, node_u, node_v, None, current)
+
+
 def __complete_igraph_without_congestion(graph):
     """Given a graph, this private method looks for the current/future itime of every edge of the graph
     that has not been given a current/future itime yet because there is not information."""
@@ -347,39 +915,128 @@ def __complete_igraph_without_congestion(graph):
                 __complete_itime(graph, node1, node2, current=False) # Define future itime for this edge.
 
 
-def build_igraph(graph, highways_list, congestions_list):
-    """Method that, given a graph, a list of highways and its congestions, defines the current and future itime for
+def build_igraph(graph, highways_list, congestions_list, snapping_index=None):
+    """Method that, given a graph, a dictionary of highways and its congestions, defines the current and future itime for
     all edges in the graph.
     First, it inserts the itime and the congestion of all those highways that do have that
     information. After this, it does the same to all other edges of the graph that haven't been able to get
-    some of the previous attributes because the lack of information."""
-
-    way_id = 0
-    for way in highways_list:
-        if congestions_list[way_id] != None and congestions_list[way_id].current != 0: # If there is current congestion info for the edge:
-            current_way_congestion = congestions_list[way_id].current
-            __expand_congestion_info(graph, way, current_way_congestion, current=True) # Expand the info to edges in the graph.
-        if congestions_list[way_id] != None and congestions_list[way_id].future != 0: # If there is future congestion info for the edge:
-            future_way_congestion = congestions_list[way_id].future
-            __expand_congestion_info(graph, way, future_way_congestion, current=False) # Expand the info to edges in the graph.
-        way_id += 1
+    some of the previous attributes because the lack of information.
+    The snapping index of the graph and highways (see 'build_snapping_index') can be given so that highways
+    do not need to be map-matched again. If it is not given, it is built."""
+
+    if snapping_index == None:
+        snapping_index = build_snapping_index(graph, highways_list)
+    for way_id, way_edges in snapping_index['edges'].items():
+        congestion = congestions_list.get(way_id)
+        if congestion != None and congestion.current != 0: # If there is current congestion info for the edge:
+            current_way_congestion = congestion.current
+            __expand_congestion_info(graph, way_edges, current_way_congestion, current=True) # Expand the info to edges in the graph.
+        if congestion != None and congestion.future != 0: # If there is future congestion info for the edge:
+            future_way_congestion = congestion.future
+            __expand_congestion_info(graph, way_edges, future_way_congestion, current=False) # Expand the info to edges in the graph.
     __complete_igraph_without_congestion(graph) # Complete the graph. Will only modify edges with no current or future info.
 
     return graph
 
 
-def plot_igraph_congestions(igraph, igraph_congestions_png, size, current):
+def __way_congestion(congestions_list, way_id, current):
+    """Private method that returns the current/future congestion of the highway with the given way_id.
+    If there is no congestion information of the highway, 0 (= No info) is returned."""
+
+    congestion = congestions_list.get(way_id)
+    if congestion == None:
+        return 0
+    if current:
+        return congestion.current
+    return congestion.future
+
+
+def __stamped_edges(snapping_index, congestions_list, current):
+    """Private method that returns a dictionary that maps every edge of the graph belonging to a highway with
+    current/future congestion information to that congestion, as inserted by 'build_igraph'
+    (if an edge belongs to more than one highway, the last one is kept)."""
+
+    stamped = {}
+    for way_id, way_edges in snapping_index['edges'].items():
+        way_congestion = __way_congestion(congestions_list, way_id, current)
+        if way_congestion != 0:
+            for edge in way_edges:
+                stamped[edge] = way_congestion
+
+    return stamped
+
+
+def __stamped_near_congestion(igraph, stamped, node_u, node_v):
+    """Private method that returns the near congestion of the edge between nodes 'u' and 'v' as '__near_congestions' does:
+    the biggest congestion of its 1-level proximity edges, looking only at the edges with congestion given by the highways
+    (the 'stamped' dictionary, see '__stamped_edges'). If no near congestion is found, the default congestion (2 = Fluid)
+    is returned. IMPORTANT: 'Closed road' congestion (6) is not expanded."""
+
+    near_edges = [(node, node_u) for node in igraph.predecessors(node_u)] + [(node_v, node) for node in igraph.successors(node_v)]
+    near_congestions = [stamped[edge] for edge in near_edges if edge in stamped and stamped[edge] != 6]
+    if len(near_congestions) == 0:
+        return 2
+
+    return max(near_congestions)
+
+
+def update_igraph(igraph, old_congestions_list, new_congestions_list, snapping_index, cgraph=None):
+    """Method that, given an igraph built from the old dictionary of congestions with 'build_compiled_igraph' (and exported
+    with 'export_compiled_igraph') or with this method, updates it with a new dictionary of congestions without building
+    it again, getting the same congestions and itimes as 'build_compiled_igraph' with the new dictionary.
+    Only the highways whose current/future congestion has changed are updated, as well as the edges with no
+    congestion information of their 1-level proximity. As the near congestion of an edge is only looked for in the
+    edges with congestion given by the highways (see '__stamped_near_congestion'), these are the only ones whose
+    near congestion may have changed. Thus, the cost depends on the number of changed highways and not on the size
+    of the graph. An igraph built with 'build_igraph' gets different congestions, as its near congestions are also
+    looked for in edges whose congestion was inferred too, so it can not be updated with this method.
+    If the compiled version of the igraph (see 'compile_igraph') is given, the updated edges are also copied into it."""
+
+    for current in [True, False]:
+        changed_ways = [way_id for way_id in snapping_index['edges']
+                        if __way_congestion(old_congestions_list, way_id, current) != __way_congestion(new_congestions_list, way_id, current)]
+        if len(changed_ways) == 0:
+            continue # Nothing to update.
+        stamped = __stamped_edges(snapping_index, new_congestions_list, current)
+        affected_edges = set()
+        for way_id in changed_ways:
+            affected_edges.update(snapping_index['edges'][way_id])
+        # Insert the new congestion of the changed highways.
+        inferred_edges = set()
+        for node_u, node_v in affected_edges:
+            if (node_u, node_v) in stamped:
+                __set_edge_itime(igraph, node_u, node_v, stamped[(node_u, node_v)], current)
+            else: # Edge has no congestion information anymore.
+                inferred_edges.add((node_u, node_v))
+        # Look for edges without congestion information whose near congestion may have changed.
+        for node_u, node_v in affected_edges:
+            for node in igraph.successors(node_v):
+                if (node_v, node) not in stamped:
+                    inferred_edges.add((node_v, node))
+            for node in igraph.predecessors(node_u):
+                if (node, node_u) not in stamped:
+                    inferred_edges.add((node, node_u))
+        for node_u, node_v in inferred_edges: # Look at near edges congestions given by the highways.
+            __set_edge_itime(igraph, node_u, node_v, __stamped_near_congestion(igraph, stamped, node_u, node_v), current)
+        if cgraph != None:
+            cgraph.update_edges(igraph, list(affected_edges | inferred_edges))
+
+    return igraph
+
+
+def plot_igraph_congestions(igraph, igraph_congestions_png, size, current, image_format=None, quality=85):
     """Method that plots either the current congestion or the future expected congestion of all edges of the graph
     in a map created with StaticMap library.
     If current = True, method will work with with current congestions. Otherwise, current = False, it will use the future congestions.
-    The created map, with defined size, is saved into a location passed as a parameter."""
+    The created map, with defined size, is saved into a location passed as a parameter or, if it is None,
+    returned as the bytes of the image encoded with the given format and quality (see 'save_image')."""
 
     colors = [None, 'Green', 'Green', 'OrangeRed', 'Red', 'DarkRed', 'Black'] # Used web colors.
     if current:
         key = 'current_congestion'
     else:
         key = 'future_congestion'
-    map = StaticMap(size, size)
+    map = new_static_map(size, size)
     for node1 in igraph:
         location1 = (Location) (igraph.nodes[node1]['x'], igraph.nodes[node1]['y']) # Get the node coordinates.
         for node2 in igraph.adj[node1]:
@@ -387,7 +1044,918 @@ def plot_igraph_congestions(igraph, igraph_congestions_png, size, current):
             line = Line((location1, location2), colors[igraph[node1][node2][key]], 1) # Draw line in map.
             map.add_line(line)
     image = map.render(zoom = 13)
-    image.save(igraph_congestions_png)
+    return save_image(image, igraph_congestions_png, image_format, quality)
+
+# Compiled iGraph
+SPEED_PERCENTAGE_BASED_ON_CONGESTION = np.array([np.nan, 1, 0.85, 0.6, 0.4, 0.2, 0]) # Index 6 (Closed road) gives an infinite itime.
+FUTURE_CONGESTION_TIME = 900 # Seconds (15 minutes) after which future congestion information is used.
+
+
+class CompiledGraph:
+    """Class that represents an igraph in a compact way, using arrays instead of networkx dictionaries,
+    in order to get paths faster and with less memory.
+    Nodes are numbered from 0 to n-1: 'nodes' contains the OSM id of every node and 'x' and 'y' its coordinates.
+    Edges are stored in CSR format: the edges that exit from node 'i' are the ones from position 'offsets[i]'
+    to 'offsets[i+1]' of the edge arrays, and 'targets' contains the node where every edge arrives.
+    Edge attributes are contiguous float arrays in the same order: 'length' (meters), 'maxspeed' (meters/second),
+    'current_congestion', 'future_congestion', 'current_itime' and 'future_itime'.
+    The street name of every edge is its position 'name' in the list of 'names' (-1 if the edge has no name)."""
+
+    def __init__(self, nodes, x, y, offsets, targets, length, maxspeed):
+        """Creates a compiled graph, with no congestion information, from its node and edge arrays."""
+
+        self.nodes = nodes
+        self.x = x
+        self.y = y
+        self.offsets = offsets
+        self.targets = targets
+        self.length = length
+        self.maxspeed = maxspeed
+        self.sources = np.repeat(np.arange(len(nodes), dtype=np.int32), np.diff(offsets)) # Node where every edge exits from.
+        self.current_congestion = np.zeros(len(targets), dtype=np.float64)
+        self.future_congestion = np.zeros(len(targets), dtype=np.float64)
+        self.current_itime = np.zeros(len(targets), dtype=np.float64)
+        self.future_itime = np.zeros(len(targets), dtype=np.float64)
+        self.name = np.full(len(targets), -1, dtype=np.int32)
+        self.names = []
+        self.epoch = 0 # Identifier of the congestions snapshot, changed every time congestions are built (see 'build_compiled_igraph').
+        self.metadata = {} # Extra information saved with the compiled graph (see 'save_compiled_graph').
+        # Edges arriving to every node, in CSR format too: 'reverse_edges' has the positions of the edges arriving to
+        # node 'i' from position 'reverse_offsets[i]' to 'reverse_offsets[i+1]'.
+        self.reverse_edges = np.argsort(targets, kind='stable').astype(np.int32)
+        self.reverse_offsets = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=len(nodes))))).astype(np.int32)
+        # OSM id to compiled node, and plain lists of the graph structure (faster than arrays in Python searches).
+        self.index = {node: i for i, node in enumerate(nodes.tolist())}
+        self.offsets_list = offsets.tolist()
+        self.targets_list = targets.tolist()
+        self.reverse_offsets_list = self.reverse_offsets.tolist()
+        self.reverse_edges_list = self.reverse_edges.tolist()
+        self.sources_list = self.sources.tolist()
+        self.length_list = length.tolist()
+        # Plain lists and sparse matrices of the current/future itimes, built only when needed and again only after
+        # the itimes change (see 'itimes' and 'itime_matrix').
+        self.itime_views = {}
+
+    def edge(self, node_u, node_v):
+        """Method that returns the position in the edge arrays of the edge from compiled node 'u' to compiled node 'v'."""
+
+        start, end = self.offsets_list[node_u], self.offsets_list[node_u+1]
+        return start + self.targets_list[start:end].index(node_v)
+
+    def edge_indices(self, edges):
+        """Method that returns an array with the position in the edge arrays of every edge (pair of OSM ids) of the list."""
+
+        return np.array([self.edge(self.index[node_u], self.index[node_v]) for node_u, node_v in edges], dtype=np.int64)
+
+    def path_edges(self, path):
+        """Method that returns a list with the position in the edge arrays of every edge of a path of compiled nodes."""
+
+        return [self.edge(node_u, node_v) for node_u, node_v in zip(path[:-1], path[1:])]
+
+    def update_edges(self, igraph, edges):
+        """Method that copies the congestions and itimes of the given edges (pairs of OSM ids) of the igraph
+        into the compiled arrays."""
+
+        indices = self.edge_indices(edges)
+        for key in ['current_congestion', 'future_congestion', 'current_itime', 'future_itime']:
+            getattr(self, key)[indices] = [igraph[node_u][node_v][key] for node_u, node_v in edges]
+        self.itime_views.clear()
+
+    def set_congestions(self, indices, congestions, current):
+        """Method that sets the current/future congestion of the edges in the given positions of the edge arrays
+        and recomputes their current/future itime (see 'compiled_itimes')."""
+
+        if current:
+            congestion_key, itime_key = 'current_congestion', 'current_itime'
+        else:
+            congestion_key, itime_key = 'future_congestion', 'future_itime'
+        getattr(self, congestion_key)[indices] = congestions
+        getattr(self, itime_key)[indices] = compiled_itimes(self.length[indices], self.maxspeed[indices], getattr(self, congestion_key)[indices])
+        self.itime_views.clear()
+
+    def itimes(self, current):
+        """Method that returns the current/future itime of every edge as a plain list (faster than arrays in Python
+        searches), which must not be changed."""
+
+        key = 'current_itime' if current else 'future_itime'
+        if key not in self.itime_views:
+            self.itime_views[key] = getattr(self, key).tolist()
+        return self.itime_views[key]
+
+    def itime_matrix(self, current):
+        """Method that returns the sparse matrix (nodes x nodes) of the current/future itime of the edges, as used by
+        the searches of SciPy, which must not be changed. Closed roads (infinite itime) are left out, and edges with
+        no itime get a tiny one, as sparse matrices have no zero-weighted edges."""
+
+        key = 'current_matrix' if current else 'future_matrix'
+        if key not in self.itime_views:
+            itimes = np.asarray(self.current_itime if current else self.future_itime, dtype=np.float64)
+            usable = np.isfinite(itimes)
+            weights = np.maximum(itimes[usable], 1e-9)
+            self.itime_views[key] = scipy.sparse.csr_matrix((weights, (self.sources[usable], self.targets[usable])), shape=(len(self.nodes), len(self.nodes)))
+        return self.itime_views[key]
+
+    def to_osm_path(self, path):
+        """Method that converts a path of compiled nodes into a path of OSM node ids, as used by the plotting methods."""
+
+        return self.nodes[path].tolist()
+
+    def copy(self):
+        """Method that returns a copy of the compiled graph that shares the arrays of the graph structure but has its
+        own congestion and itime arrays, so they can be built while this one is still used."""
+
+        cgraph = CompiledGraph.__new__(CompiledGraph)
+        cgraph.__dict__.update(self.__dict__)
+        for key in ['current_congestion', 'future_congestion', 'current_itime', 'future_itime']:
+            setattr(cgraph, key, np.array(getattr(self, key)))
+        cgraph.itime_views = {}
+        cgraph.metadata = dict(self.metadata)
+
+        return cgraph
+
+
+def compile_igraph(igraph):
+    """Method that returns the compiled version (see 'CompiledGraph') of a graph. If the graph is an igraph
+    built with 'build_igraph', its congestions and itimes are compiled too.
+    The 'maxspeed' attribute of every edge is parsed only once here (see '__parse_maxspeed') and
+    its 'name' is kept as the position of the street name in the list of names."""
+
+    nodes = list(igraph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    offsets = [0]
+    targets = []
+    length = []
+    maxspeed = []
+    name = []
+    names = {} # Position of every street name in the list of names.
+    edges = []
+    for node_u in nodes:
+        for node_v, data in igraph.adj[node_u].items():
+            targets.append(index[node_v])
+            if 'length' in data:
+                length.append(data['length'])
+            else: # Edge does not have a defined length. Calculate it with haversine library.
+                location_u = (igraph.nodes[node_u]['y'], igraph.nodes[node_u]['x'])
+                location_v = (igraph.nodes[node_v]['y'], igraph.nodes[node_v]['x'])
+                length.append(haversine(location_u, location_v, unit='m'))
+            maxspeed.append(__parse_maxspeed(data.get('maxspeed', '30'))) # Default '30' km/h speed.
+            street = data.get('name')
+            if isinstance(street, list): # Edge merged from ways with different names.
+                street = street[0]
+            name.append(names.setdefault(street, len(names)) if isinstance(street, str) else -1)
+            edges.append((node_u, node_v))
+        offsets.append(len(targets))
+    cgraph = CompiledGraph(np.array(nodes, dtype=np.int64),
+                           np.array([igraph.nodes[node]['x'] for node in nodes], dtype=np.float64),
+                           np.array([igraph.nodes[node]['y'] for node in nodes], dtype=np.float64),
+                           np.array(offsets, dtype=np.int32), np.array(targets, dtype=np.int32),
+                           np.array(length, dtype=np.float64), np.array(maxspeed, dtype=np.float64))
+    cgraph.name = np.array(name, dtype=np.int32)
+    cgraph.names = list(names)
+    if len(edges) != 0 and 'future_itime' in igraph[edges[0][0]][edges[0][1]]: # Graph is an igraph.
+        cgraph.update_edges(igraph, edges)
+
+    return cgraph
+
+
+def compiled_itimes(length, maxspeed, congestion):
+    """Method that computes at once the itime of all edges given by arrays of their length, maximum speed (m/s)
+    and congestion, as defined in '__set_edge_itime'. Closed roads (congestion 6) get an infinite itime."""
+
+    percentage = SPEED_PERCENTAGE_BASED_ON_CONGESTION[congestion.astype(np.int64)]
+    with np.errstate(divide='ignore'):
+        return length/(percentage*maxspeed)
+
+
+def __near_congestions(cgraph, stamped_congestions):
+    """Private method that computes at once, for every edge of a compiled graph, the biggest congestion of its
+    1-level proximity edges (see '__get_near_congestion') from an array with the congestion given to every edge
+    by the highways (0 if none).
+    The biggest congestion of the edges arriving to and exiting from every node is found with sparse matrices
+    of nodes x edges. If no near congestion is found, the default congestion (2 = Fluid) is returned.
+    IMPORTANT: 'Closed road' congestion (6) is not expanded."""
+
+    values = np.where(stamped_congestions == 6, 0, stamped_congestions)
+    edges = np.arange(len(values))
+    shape = (len(cgraph.nodes), len(values))
+    arriving = scipy.sparse.csr_matrix((values, (cgraph.targets, edges)), shape=shape).max(axis=1).toarray().ravel()
+    exiting = scipy.sparse.csr_matrix((values, (cgraph.sources, edges)), shape=shape).max(axis=1).toarray().ravel()
+    near_congestions = np.maximum(arriving[cgraph.sources], exiting[cgraph.targets]) # Edges arriving to 'u' and exiting from 'v'.
+
+    return np.where(near_congestions == 0, 2, near_congestions)
+
+
+def build_compiled_igraph(cgraph, highways_list, congestions_list, snapping_index):
+    """Method that, as 'build_igraph' does with a graph, defines the current and future congestion and itime of all
+    edges of a compiled graph (see 'compile_igraph') at once with NumPy arrays instead of edge by edge.
+    Edges of highways with congestion information get it, and all other edges get the biggest congestion of
+    their 1-level proximity edges with information (see '__near_congestions'). Unlike '__get_near_congestion',
+    only congestions given by the highways are looked at, so the result does not depend on the order of the edges.
+    Returns the array with the positions of the edges whose current or future congestion has changed.
+    The 'epoch' of the compiled graph is increased, so routes cached with the previous congestions are not used anymore.
+    It is the time of the build (nanoseconds) unless that is not bigger than the previous epoch, so epochs never repeat
+    even if the graph is built again from an older file after the bot is restarted."""
+
+    way_indices = {way_id: cgraph.edge_indices(way_edges) for way_id, way_edges in snapping_index['edges'].items()}
+    old_current_congestion = cgraph.current_congestion.copy()
+    old_future_congestion = cgraph.future_congestion.copy()
+    for current in [True, False]:
+        stamped_congestions = np.zeros(len(cgraph.targets), dtype=np.float64)
+        for way_id, indices in way_indices.items():
+            way_congestion = __way_congestion(congestions_list, way_id, current)
+            if way_congestion != 0: # If there is congestion info for the highway.
+                stamped_congestions[indices] = way_congestion
+        congestions = np.where(stamped_congestions != 0, stamped_congestions, __near_congestions(cgraph, stamped_congestions))
+        cgraph.set_congestions(slice(None), congestions, current) # Also computes all itimes.
+    cgraph.epoch = max(cgraph.epoch + 1, time.time_ns())
+
+    changed = (cgraph.current_congestion != old_current_congestion) | (cgraph.future_congestion != old_future_congestion)
+    return np.flatnonzero(changed)
+
+
+def export_compiled_igraph(cgraph, graph=None, indices=None):
+    """Method that inserts the current and future congestion and itime of the compiled graph edges
+    into the edges of the graph it was compiled from, so that it can be used as an igraph (to plot it, for instance).
+    If an array with the positions of some edges is given, only those edges are inserted. Returns the graph.
+    If no graph is given, the networkx graph is built from the compiled graph with all its edges (see 'load_graph')."""
+
+    if graph is None:
+        return __compiled_to_graph(cgraph)
+    if indices is None:
+        indices = np.arange(len(cgraph.targets))
+    nodes_u = cgraph.nodes[cgraph.sources[indices]].tolist()
+    nodes_v = cgraph.nodes[cgraph.targets[indices]].tolist()
+    for key in ['current_congestion', 'future_congestion', 'current_itime', 'future_itime']:
+        values = getattr(cgraph, key)[indices].tolist()
+        if key.endswith('congestion'):
+            values = [int(value) for value in values] # Congestions are used as indices of colors.
+        for node_u, node_v, value in zip(nodes_u, nodes_v, values):
+            graph[node_u][node_v][key] = value
+
+    return graph
+
+
+def __compiled_dijkstra(cgraph, source, target, weights, heuristic=None, settled=None):
+    """Private method that returns the shortest path (list of compiled nodes) from node 'source' to node 'target'
+    of a compiled graph, and its total weight, using Dijkstra algorithm with the given list of edge weights.
+    If a list with a lower bound of the remaining weight from every node to the target is given as 'heuristic',
+    A* algorithm is used instead. Edges with infinite weight (closed roads) are not used.
+    If a set is given as 'settled', the nodes settled by the search are added to it.
+    If there is no path, a networkx.NetworkXNoPath exception is raised."""
+
+    offsets, targets = cgraph.offsets_list, cgraph.targets_list
+    distances = {source: 0}
+    predecessors = {source: None}
+    visited = set() if settled == None else settled
+    heap = [(0, source)]
+    while len(heap) != 0:
+        _, node_u = heapq.heappop(heap)
+        if node_u in visited:
+            continue
+        if node_u == target: # Best path found.
+            break
+        visited.add(node_u)
+        for edge in range(offsets[node_u], offsets[node_u+1]):
+            distance = distances[node_u] + weights[edge]
+            node_v = targets[edge]
+            if distance < distances.get(node_v, float('inf')):
+                distances[node_v] = distance
+                predecessors[node_v] = node_u
+                if heuristic == None:
+                    heapq.heappush(heap, (distance, node_v))
+                else:
+                    heapq.heappush(heap, (distance + heuristic[node_v], node_v))
+    if target not in distances:
+        raise nx.NetworkXNoPath(f"No path to {target}.")
+    path = [target]
+    while predecessors[path[-1]] != None:
+        path.append(predecessors[path[-1]])
+    path.reverse()
+
+    return path, distances[target]
+
+
+def __haversine_heuristic(cgraph, node):
+    """Private method that returns an array with a lower bound of the itime (seconds) between every node of a compiled
+    graph and the given node: the great-circle distance between them divided by the maximum speed of the graph."""
+
+    lng, lat = np.radians(cgraph.x), np.radians(cgraph.y)
+    a = np.sin((lat - lat[node])/2)**2 + np.cos(lat)*np.cos(lat[node])*np.sin((lng - lng[node])/2)**2
+    distances = 2*6371008.8*np.arcsin(np.sqrt(a)) # Meters (same Earth radius as haversine library).
+
+    return distances/cgraph.maxspeed.max()
+
+
+def __compiled_bidirectional_astar(cgraph, source, target, weights, settled=None):
+    """Private method that returns the shortest path (list of compiled nodes) from node 'source' to node 'target'
+    of a compiled graph, and its total weight, as '__compiled_dijkstra' does but with bidirectional A* algorithm.
+    A search from the source (through 'offsets') and a search to the target (through 'reverse_offsets') are done
+    at the same time, both with the average of the haversine heuristic to the target and from the source (see
+    '__haversine_heuristic'), so that they stop as soon as no better path can be found where they meet.
+    With these potentials, the key of a node is its itime from the source plus its potential (forward search) or its
+    itime to the target minus its potential (backward search), and every path through a node takes at least its key
+    minus the potential of the target (forward) or plus the potential of the source (backward). So the searches stop
+    when the sum of their smallest keys reaches the best itime found, which is the exact bound for these keys (any
+    smaller one may miss the shortest path), and nodes whose key can not lead to a better path are not pushed.
+    If a list of two sets is given as 'settled', the nodes settled by the forward and backward searches are added to them.
+    If the source is the target, the path is only the source, with no weight.
+    If there is no path, a networkx.NetworkXNoPath exception is raised."""
+
+    if source == target: # The searches would only meet after going round a loop.
+        return [source], 0
+    potentials = ((__haversine_heuristic(cgraph, target) - __haversine_heuristic(cgraph, source))/2).tolist()
+    bounds = [potentials[target], -potentials[source]] # Keys from which no better path can be found on every side.
+    distances = [{source: 0}, {target: 0}] # Forward and backward searches.
+    predecessors = [{source: None}, {target: None}]
+    visited = [set(), set()] if settled == None else settled
+    heaps = [[(potentials[source], source)], [(-potentials[target], target)]]
+    best, meeting = float('inf'), None
+    while len(heaps[0]) != 0 and len(heaps[1]) != 0:
+        if heaps[0][0][0] + heaps[1][0][0] >= best: # No better path can be found.
+            break
+        side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        _, node_u = heapq.heappop(heaps[side])
+        if node_u in visited[side]:
+            continue
+        visited[side].add(node_u)
+        if side == 0:
+            edges = range(cgraph.offsets_list[node_u], cgraph.offsets_list[node_u+1])
+        else:
+            edges = cgraph.reverse_edges_list[cgraph.reverse_offsets_list[node_u]:cgraph.reverse_offsets_list[node_u+1]]
+        for edge in edges:
+            node_v = cgraph.targets_list[edge] if side == 0 else cgraph.sources_list[edge]
+            distance = distances[side][node_u] + weights[edge]
+            if distance < distances[side].get(node_v, float('inf')):
+                distances[side][node_v] = distance
+                predecessors[side][node_v] = node_u
+                if node_v in distances[1-side] and distance + distances[1-side][node_v] < best: # Searches meet.
+                    best, meeting = distance + distances[1-side][node_v], node_v
+                key = distance + potentials[node_v] if side == 0 else distance - potentials[node_v]
+                if key < best + bounds[side]: # A better path may go through it.
+                    heapq.heappush(heaps[side], (key, node_v))
+    if meeting == None:
+        raise nx.NetworkXNoPath(f"No path to {target}.")
+    path = [meeting]
+    while predecessors[0][path[-1]] != None:
+        path.append(predecessors[0][path[-1]])
+    path.reverse()
+    while predecessors[1][path[-1]] != None:
+        path.append(predecessors[1][path[-1]])
+
+    return path, best
+
+
+def get_compiled_shortest_path_with_itime(cgraph, node_origin, node_destination, current, bidirectional_astar=False):
+    """Given a compiled igraph and an origin and destination OSM nodes, this method returns the shortest
+    path from origin to destination looking at edges current/future itime, as 'get_shortest_path_with_itime'
+    does with the igraph.
+    If current=True, method will look for current itime. Otherwise will do the same but for the future itime.
+    The path is found with the Dijkstra algorithm of SciPy (see 'CompiledGraph.itime_matrix'), which is compiled code,
+    or, if bidirectional_astar=True, with bidirectional A* algorithm (see '__compiled_bidirectional_astar'),
+    which looks at far fewer nodes for trips inside the city.
+    If there is no path, a networkx.NetworkXNoPath exception is raised."""
+
+    source, target = cgraph.index[node_origin], cgraph.index[node_destination]
+    if bidirectional_astar:
+        path, _ = __compiled_bidirectional_astar(cgraph, source, target, cgraph.itimes(current))
+    else:
+        _, predecessors = scipy.sparse.csgraph.dijkstra(cgraph.itime_matrix(current), directed=True, indices=source, return_predecessors=True)
+        if source != target and predecessors[target] < 0:
+            raise nx.NetworkXNoPath(f"No path to {target}.")
+        path, node = [target], target
+        while node != source: # Predecessors go from the destination back to the origin.
+            node = predecessors[node]
+            path.append(node)
+        path.reverse()
+
+    return cgraph.to_osm_path(path) # The shortest path is a list of node ids.
+
+
+def get_alternative_paths_with_itime(cgraph, node_origin, node_destination, k, current, max_similarity=0.7, max_stretch=1.5, penalty=1.4, max_iterations=10, shortest_path=None):
+    """Given a compiled igraph and an origin and destination OSM nodes, this method returns up to k different paths
+    from origin to destination looking at edges current/future itime, being the first one the shortest path, as
+    'get_k_shortest_paths_with_itime' does with the igraph but much faster.
+    Alternatives are found with the penalty method: the itime of the edges of every path found is multiplied by
+    'penalty' and a new shortest path is looked for, at most 'max_iterations' times. A path is only accepted if at most
+    'max_similarity' of its length is shared with each accepted path and its itime is at most 'max_stretch' times
+    the itime of the shortest path, so paths that differ by one block are not returned.
+    If current=True, method will look for current itime. Otherwise will do the same but for the future itime.
+    If the shortest path (list of compiled nodes) is already known, it can be given so that it is not looked for again."""
+
+    itimes = cgraph.itimes(current)
+    source, target = cgraph.index[node_origin], cgraph.index[node_destination]
+    weights = list(itimes) # Penalized itimes.
+    lengths = cgraph.length_list
+    accepted = [] # Sets of edges of the accepted paths.
+    ipaths = []
+    best_time = None
+    for _ in range(max_iterations):
+        if shortest_path != None and len(ipaths) == 0:
+            path = shortest_path
+        else:
+            path, _ = __compiled_bidirectional_astar(cgraph, source, target, weights) # Penalties keep the heuristic valid.
+        edges = cgraph.path_edges(path)
+        time = sum(itimes[edge] for edge in edges)
+        length = sum(lengths[edge] for edge in edges)
+        if best_time == None:
+            best_time = time
+        if time > max_stretch*best_time:
+            break # Penalized paths will only get slower.
+        if all(sum(lengths[edge] for edge in edges if edge in other) <= max_similarity*length for other in accepted):
+            accepted.append(set(edges))
+            ipaths.append(cgraph.to_osm_path(path))
+            if len(ipaths) == k or len(edges) == 0: # Origin is destination: there is no other path.
+                break
+        for edge in edges: # Penalize the edges of the path found.
+            weights[edge] *= penalty
+
+    return ipaths # Returns a list of paths, where every path is a list of nodes.
+
+
+def __time_dependent_arrival(time, current_itime, future_itime):
+    """Private method that returns the time when an edge is left if it is entered at the given time (seconds since departure).
+    The edge is gone through at the speed given by its current congestion until 'FUTURE_CONGESTION_TIME' and at the speed
+    given by its future congestion after it, so the part of the edge done before that time is done with its current itime
+    and the rest with its future itime. Then, entering an edge later never means leaving it earlier."""
+
+    if time >= FUTURE_CONGESTION_TIME:
+        return time + future_itime
+    if time + current_itime <= FUTURE_CONGESTION_TIME:
+        return time + current_itime
+    done = (FUTURE_CONGESTION_TIME - time)/current_itime # Part of the edge done with current itime.
+    return FUTURE_CONGESTION_TIME + (1 - done)*future_itime
+
+
+def __compiled_time_dependent_dijkstra(cgraph, source, target):
+    """Private method that returns the fastest path (list of compiled nodes) from node 'source' to node 'target'
+    of a compiled graph and the time of arrival of every node of it, using time-dependent Dijkstra algorithm:
+    the cost of every edge depends on the time it is reached (see '__time_dependent_arrival').
+    If there is no path, a networkx.NetworkXNoPath exception is raised."""
+
+    offsets, targets = cgraph.offsets_list, cgraph.targets_list
+    current_itimes, future_itimes = cgraph.itimes(True), cgraph.itimes(False)
+    arrivals = {source: 0}
+    predecessors = {source: None}
+    visited = set()
+    heap = [(0, source)]
+    while len(heap) != 0:
+        time, node_u = heapq.heappop(heap)
+        if node_u in visited:
+            continue
+        if node_u == target: # Fastest path found.
+            break
+        visited.add(node_u)
+        for edge in range(offsets[node_u], offsets[node_u+1]):
+            arrival = __time_dependent_arrival(time, current_itimes[edge], future_itimes[edge])
+            node_v = targets[edge]
+            if arrival < arrivals.get(node_v, float('inf')):
+                arrivals[node_v] = arrival
+                predecessors[node_v] = node_u
+                heapq.heappush(heap, (arrival, node_v))
+    if target not in arrivals:
+        raise nx.NetworkXNoPath(f"No path to {target}.")
+    path = [target]
+    while predecessors[path[-1]] != None:
+        path.append(predecessors[path[-1]])
+    path.reverse()
+
+    return path, [arrivals[node] for node in path]
+
+
+def get_time_dependent_shortest_path(cgraph, node_origin, node_destination):
+    """Given a compiled igraph and an origin and destination OSM nodes, this method returns the fastest path from
+    origin to destination using current itimes until 'FUTURE_CONGESTION_TIME' and future itimes after it,
+    with a single time-dependent search (see '__compiled_time_dependent_dijkstra').
+    The path is returned split into two lists of node ids, as '__get_3_best_ipaths' does: the part of the path reached
+    before 'FUTURE_CONGESTION_TIME' and the rest of it (starting with the last node of the first part), which is empty
+    if the destination is reached before 'FUTURE_CONGESTION_TIME'."""
+
+    source, target = cgraph.index[node_origin], cgraph.index[node_destination]
+    path, arrivals = __compiled_time_dependent_dijkstra(cgraph, source, target)
+
+    return __split_time_dependent_path(cgraph, path, arrivals)
+
+
+def __split_time_dependent_path(cgraph, path, arrivals):
+    """Private method that splits a path of compiled nodes into the part reached before 'FUTURE_CONGESTION_TIME'
+    and the rest of it (starting with the last node of the first part), given the time of arrival of every node,
+    and returns them as lists of node ids (see 'get_time_dependent_shortest_path')."""
+
+    split = 0
+    while split < len(path) and arrivals[split] <= FUTURE_CONGESTION_TIME:
+        split += 1
+    current_path = cgraph.to_osm_path(path[:split])
+    future_path = []
+    if split < len(path):
+        future_path = cgraph.to_osm_path(path[split-1:])
+
+    return current_path, future_path
+
+
+# Travel time matrix
+def get_travel_time_matrix(cgraph, spatial_index, origins, destinations, current=True, paths=False):
+    """Method that returns a NumPy matrix with the itime (seconds) of the shortest path from every origin to every
+    destination, given as lists of Locations, in a compiled igraph (infinite if there is no path). All Locations are
+    snapped at once with the spatial index of the graph (see 'build_spatial_index').
+    Shortest paths are found with current itimes (current = True) or future itimes (current = False) by the
+    multi-source Dijkstra of SciPy, from the side (origins or destinations) with less different nodes, so the cost
+    depends on the number of different origins or destinations and not on the number of pairs.
+    If 'paths' is True, a matrix (list of lists) with the paths (lists of OSM node ids, None if there is no path)
+    is returned too."""
+
+    origin_nodes = spatial_index.nearest_nodes([location.lng for location in origins], [location.lat for location in origins])
+    destination_nodes = spatial_index.nearest_nodes([location.lng for location in destinations], [location.lat for location in destinations])
+    origin_nodes = [cgraph.index[node] for node in origin_nodes]
+    destination_nodes = [cgraph.index[node] for node in destination_nodes]
+    sources = sorted(set(origin_nodes))
+    targets = sorted(set(destination_nodes))
+    forward = len(sources) <= len(targets)
+    matrix = cgraph.itime_matrix(current)
+    if forward: # From every origin to all nodes.
+        distances, predecessors = scipy.sparse.csgraph.dijkstra(matrix, directed=True, indices=sources, return_predecessors=True)
+    else: # From every destination to all nodes, going backwards through the edges.
+        distances, predecessors = scipy.sparse.csgraph.dijkstra(matrix.T.tocsr(), directed=True, indices=targets, return_predecessors=True)
+    row = {node: i for i, node in enumerate(sources if forward else targets)}
+
+    if forward:
+        times = distances[[row[node] for node in origin_nodes]][:, destination_nodes]
+    else:
+        times = distances[[row[node] for node in destination_nodes]][:, origin_nodes].T
+    if not paths:
+        return times
+
+    path_matrix = []
+    for i, source in enumerate(origin_nodes):
+        path_row = []
+        for j, target in enumerate(destination_nodes):
+            if times[i, j] == np.inf:
+                path_row.append(None)
+                continue
+            if forward: # Predecessors go from the destination back to the origin.
+                path, node = [target], target
+                while node != source:
+                    node = predecessors[row[source], node]
+                    path.append(node)
+                path.reverse()
+            else: # Predecessors go from the origin forward to the destination.
+                path, node = [source], source
+                while node != target:
+                    node = predecessors[row[target], node]
+                    path.append(node)
+            path_row.append(cgraph.to_osm_path(path))
+        path_matrix.append(path_row)
+
+    return times, path_matrix
+
+
+# Congestions raster
+CONGESTION_COLORS = [None, 'Green', 'Green', 'OrangeRed', 'Red', 'DarkRed', 'Black'] # Used web colors for every congestion value.
+__base_layers = {} # Map tiles already rendered for every size, zoom and center (see '__base_layer').
+
+
+def __base_layer(size, zoom, center):
+    """Private method that returns the map tiles, with no lines, of a map of the given size, zoom and center, rendered
+    with StaticMap library only the first time they are needed, as they do not change when congestions do."""
+
+    key = (size, zoom, center)
+    if key not in __base_layers:
+        __base_layers[key] = new_static_map(size, size).render(zoom=zoom, center=list(center))
+    return __base_layers[key]
+
+
+def __x_tile(lng, zoom):
+    """Private method that converts longitudes into x tile numbers of the given zoom (as StaticMap does)."""
+
+    return (lng + 180) / 360 * 2 ** zoom
+
+
+def __y_tile(lat, zoom):
+    """Private method that converts latitudes into y tile numbers of the given zoom (as StaticMap does)."""
+
+    return (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2 * 2 ** zoom
+
+
+def __draw_edges(cgraph, image, zoom, center, colored_edges, width=1):
+    """Private method that draws edges of a compiled graph onto a map image (its map tiles) of the given zoom and center
+    and returns it. Edges are given as a list of pairs of a color and an array with the positions of the edges drawn
+    with it, in that order. All nodes are projected at once with NumPy and lines are drawn with PIL."""
+
+    size_x, size_y = image.size
+    lngs, lats = np.asarray(cgraph.x, dtype=np.float64), np.asarray(cgraph.y, dtype=np.float64)
+
+    # Project all nodes into pixels (rounded as StaticMap does) of an image twice the size (resized at the end to get smooth lines).
+    px = np.round((__x_tile(lngs, zoom) - __x_tile(center[0], zoom)) * 256 + size_x / 2).astype(np.int64) * 2
+    py = np.round((__y_tile(lats, zoom) - __y_tile(center[1], zoom)) * 256 + size_y / 2).astype(np.int64) * 2
+
+    lines = PIL.Image.new('RGBA', (size_x * 2, size_y * 2), (255, 0, 0, 0))
+    draw = PIL.ImageDraw.Draw(lines)
+    segments = np.stack([px[cgraph.sources], py[cgraph.sources], px[cgraph.targets], py[cgraph.targets]], axis=1)
+    for color, edges in colored_edges:
+        for segment in segments[edges].tolist():
+            draw.line(segment, fill=color, width=width * 2)
+    lines = lines.resize((size_x, size_y), PIL.Image.LANCZOS)
+    image.paste(lines, (0, 0), lines)
+
+    return image
+
+
+def render_congestions(cgraph, size, current, zoom=13):
+    """Method that returns the image (a PIL image) of either the current congestion or the future expected congestion
+    of all edges of a compiled igraph (see 'build_compiled_igraph'), the same map drawn by 'plot_igraph_congestions'.
+    Instead of a StaticMap Line for every edge, all nodes are projected at once with NumPy and the edges of every
+    congestion are drawn together with PIL onto the map tiles, which are only rendered once (see '__base_layer').
+    Edges are drawn from the least to the most congested, so the most congested direction of a way is the one shown."""
+
+    congestions = cgraph.current_congestion if current else cgraph.future_congestion
+
+    # Center of the map: center of the extent of the edges (as StaticMap does).
+    used = np.unique(np.concatenate([cgraph.sources, cgraph.targets]))
+    center = ((cgraph.x[used].min() + cgraph.x[used].max()) / 2, (cgraph.y[used].min() + cgraph.y[used].max()) / 2)
+    image = __base_layer(size, zoom, center).copy()
+    colored_edges = [(CONGESTION_COLORS[congestion], np.flatnonzero(congestions == congestion)) for congestion in range(1, len(CONGESTION_COLORS))]
+
+    return __draw_edges(cgraph, image, zoom, center, colored_edges)
+
+
+def plot_compiled_igraph_congestions(cgraph, igraph_congestions_png, size, current, image_format=None, quality=85):
+    """Method that saves the map of either the current or the future congestion of all edges of a compiled igraph
+    (see 'render_congestions') into a location passed as a parameter or, if it is None, returns the bytes of the
+    image encoded with the given format and quality (see 'save_image')."""
+
+    return save_image(render_congestions(cgraph, size, current), igraph_congestions_png, image_format, quality)
+
+
+# Isochrone
+ISOCHRONE_COLORS = ['Green', 'OrangeRed', 'Red'] # Used web colors for every third of the time budget of an isochrone.
+MAX_ISOCHRONE_ZOOM = 16 # Highest zoom of the map of an isochrone (see 'render_isochrone').
+
+
+def __compiled_bounded_dijkstra(cgraph, source, budget):
+    """Private method that returns the time of arrival of every node of a compiled graph reached from node 'source'
+    within 'budget' seconds and the time every edge fully gone through within it is left, as dicts, using
+    time-dependent Dijkstra algorithm (see '__compiled_time_dependent_dijkstra') stopped at the budget:
+    arrivals over it are never pushed into the heap, so only the reachable area is explored."""
+
+    offsets, targets = cgraph.offsets_list, cgraph.targets_list
+    current_itimes, future_itimes = cgraph.itimes(True), cgraph.itimes(False)
+    arrivals = {source: 0}
+    edges = {}
+    visited = set()
+    heap = [(0, source)]
+    while len(heap) != 0:
+        time, node_u = heapq.heappop(heap)
+        if node_u in visited:
+            continue
+        visited.add(node_u)
+        for edge in range(offsets[node_u], offsets[node_u+1]):
+            arrival = __time_dependent_arrival(time, current_itimes[edge], future_itimes[edge])
+            if arrival > budget: # Edge not fully gone through within the budget.
+                continue
+            edges[edge] = arrival
+            node_v = targets[edge]
+            if arrival < arrivals.get(node_v, float('inf')):
+                arrivals[node_v] = arrival
+                heapq.heappush(heap, (arrival, node_v))
+
+    return arrivals, edges
+
+
+def get_isochrone(cgraph, spatial_index, origin, budget):
+    """Method that returns the area of a compiled igraph reachable from an origin Location within 'budget' seconds,
+    using current itimes until 'FUTURE_CONGESTION_TIME' and future itimes after it (see '__compiled_bounded_dijkstra').
+    The origin is snapped with the spatial index of the graph (see 'build_spatial_index').
+    The area is returned as a dict with the time of arrival (seconds) of every reached OSM node and a dict with
+    the time every edge (pair of OSM nodes) reached is left."""
+
+    node_origin = spatial_index.nearest_nodes([origin.lng], [origin.lat])[0]
+    arrivals, edges = __compiled_bounded_dijkstra(cgraph, cgraph.index[node_origin], budget)
+    nodes, sources, targets = cgraph.nodes.tolist(), cgraph.sources_list, cgraph.targets_list
+
+    return ({nodes[node]: time for node, time in arrivals.items()},
+            {(nodes[sources[edge]], nodes[targets[edge]]): time for edge, time in edges.items()})
+
+
+def __isochrone_zoom(lngs, lats, size):
+    """Private method that returns the highest zoom (up to 'MAX_ISOCHRONE_ZOOM') at which the extent of the given
+    longitudes and latitudes fits in 90% of a map of the given size."""
+
+    for zoom in range(MAX_ISOCHRONE_ZOOM, 0, -1):
+        width = (__x_tile(max(lngs), zoom) - __x_tile(min(lngs), zoom)) * 256
+        height = (__y_tile(min(lats), zoom) - __y_tile(max(lats), zoom)) * 256
+        if width <= 0.9 * size and height <= 0.9 * size:
+            return zoom
+    return 0
+
+
+def render_isochrone(cgraph, isochrone, origin, budget, size):
+    """Method that returns the image (a PIL image) of the area reachable within 'budget' seconds from an origin
+    Location (see 'get_isochrone'). Every edge is drawn with the color of the third of the budget it is left in
+    (see 'ISOCHRONE_COLORS'), the latest ones first, as 'render_congestions' does, and the origin is marked with a dot.
+    The map is centered on the reached area, with the highest zoom it fits in."""
+
+    arrivals, edges = isochrone
+    lngs = [origin.lng] + [float(cgraph.x[cgraph.index[node]]) for node in arrivals]
+    lats = [origin.lat] + [float(cgraph.y[cgraph.index[node]]) for node in arrivals]
+    zoom = __isochrone_zoom(lngs, lats, size)
+    center = ((min(lngs) + max(lngs)) / 2, (min(lats) + max(lats)) / 2)
+    image = new_static_map(size, size).render(zoom=zoom, center=list(center))
+
+    indices = cgraph.edge_indices(list(edges.keys()))
+    bands = np.minimum(np.array(list(edges.values()), dtype=np.float64) * len(ISOCHRONE_COLORS) // max(budget, 1), len(ISOCHRONE_COLORS) - 1)
+    colored_edges = [(ISOCHRONE_COLORS[band], indices[bands == band]) for band in reversed(range(len(ISOCHRONE_COLORS)))]
+    image = __draw_edges(cgraph, image, zoom, center, colored_edges, width=2)
+
+    # Mark the origin with a dot.
+    x = (__x_tile(origin.lng, zoom) - __x_tile(center[0], zoom)) * 256 + size / 2
+    y = (__y_tile(origin.lat, zoom) - __y_tile(center[1], zoom)) * 256 + size / 2
+    PIL.ImageDraw.Draw(image).ellipse([x - 6, y - 6, x + 6, y + 6], fill='Blue', outline='White', width=2)
+
+    return image
+
+
+def plot_isochrone(cgraph, isochrone, origin, budget, isochrone_png, size, image_format=None, quality=85):
+    """Method that saves the map of the area reachable within 'budget' seconds from an origin Location
+    (see 'render_isochrone') into a location passed as a parameter or, if it is None, returns the bytes of the image
+    encoded with the given format and quality (see 'save_image')."""
+
+    return save_image(render_isochrone(cgraph, isochrone, origin, budget, size), isochrone_png, image_format, quality)
+
+
+# Binary graph format
+GRAPH_FORMAT_MAGIC = b'IGOGRAPH'
+GRAPH_FORMAT_VERSION = 2
+GRAPH_FORMAT_ARRAYS = ['nodes', 'x', 'y', 'offsets', 'targets', 'length', 'maxspeed', 'name',
+                       'current_congestion', 'future_congestion', 'current_itime', 'future_itime']
+
+
+def save_compiled_graph(cgraph, graph_filename, metadata=None):
+    """Method that saves a compiled graph in the binary format with the filename (or path) passed as a parameter.
+    The file starts with 'GRAPH_FORMAT_MAGIC', the format version and the length of a JSON header that describes
+    the arrays of the compiled graph (name, dtype, shape and position in the file), which follow it aligned to
+    64 bytes so that they can be memory-mapped when loaded (see 'load_compiled_graph').
+    The street 'names', the 'epoch' and the 'metadata' dictionary of the compiled graph (or the given one, which does not
+    change the compiled graph) are saved in the header too.
+    The file is written with another name and then renamed, so processes that have mapped the old file keep using it."""
+
+    arrays = [np.ascontiguousarray(getattr(cgraph, name)) for name in GRAPH_FORMAT_ARRAYS]
+    descriptions = []
+    offset = 0
+    for name, array in zip(GRAPH_FORMAT_ARRAYS, arrays):
+        descriptions.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+        offset += -(-array.nbytes//64)*64 # Next multiple of 64 bytes.
+    if metadata == None:
+        metadata = cgraph.metadata
+    header = json.dumps({'arrays': descriptions, 'names': cgraph.names, 'epoch': cgraph.epoch, 'metadata': metadata}).encode()
+    start = -(-(len(GRAPH_FORMAT_MAGIC) + 8 + len(header))//64)*64 # Arrays start aligned to 64 bytes.
+    with open(graph_filename + '.tmp', 'wb') as file:
+        file.write(GRAPH_FORMAT_MAGIC + struct.pack('<II', GRAPH_FORMAT_VERSION, len(header)) + header)
+        for description, array in zip(descriptions, arrays):
+            file.seek(start + description['offset'])
+            file.write(array.tobytes())
+        file.truncate(start + offset)
+    os.replace(graph_filename + '.tmp', graph_filename)
+
+
+def __is_binary_graph(graph_filename):
+    """Private method that returns True if the given file is a graph saved in the binary format. Otherwise, return False."""
+
+    with open(graph_filename, 'rb') as file:
+        return file.read(len(GRAPH_FORMAT_MAGIC)) == GRAPH_FORMAT_MAGIC
+
+
+def __read_binary_header(graph_filename):
+    """Private method that returns the header of a graph saved in the binary format, with its 'version' and
+    the position in the file where the arrays 'start'."""
+
+    with open(graph_filename, 'rb') as file:
+        file.seek(len(GRAPH_FORMAT_MAGIC))
+        version, header_length = struct.unpack('<II', file.read(8))
+        header = json.loads(file.read(header_length).decode())
+    header['version'] = version
+    header['start'] = -(-(len(GRAPH_FORMAT_MAGIC) + 8 + header_length)//64)*64
+
+    return header
+
+
+def load_compiled_graph(graph_filename):
+    """Method that returns the compiled graph saved in the binary format with the given filename (or path).
+    Arrays are memory-mapped instead of read, so loading takes milliseconds and all processes that load the same file
+    share its memory. Congestion and itime arrays are mapped copy-on-write, so they can be changed by each process
+    without changing the file."""
+
+    header = __read_binary_header(graph_filename)
+    if header['version'] != GRAPH_FORMAT_VERSION:
+        raise ValueError(f"Unsupported graph format version {header['version']}.")
+    arrays = {}
+    for description in header['arrays']:
+        mode = 'c' if description['name'].endswith(('congestion', 'itime')) else 'r'
+        arrays[description['name']] = np.memmap(graph_filename, dtype=np.dtype(description['dtype']), mode=mode,
+                                                offset=header['start'] + description['offset'], shape=tuple(description['shape']))
+    cgraph = CompiledGraph(arrays['nodes'], arrays['x'], arrays['y'], arrays['offsets'], arrays['targets'], arrays['length'], arrays['maxspeed'])
+    for key in ['current_congestion', 'future_congestion', 'current_itime', 'future_itime']:
+        setattr(cgraph, key, arrays[key])
+    cgraph.name = arrays['name']
+    cgraph.names = header['names']
+    cgraph.epoch = header['epoch']
+    cgraph.metadata = header.get('metadata', {})
+
+    return cgraph
+
+
+def __compiled_to_graph(cgraph):
+    """Private method that returns the networkx directed graph of a compiled graph, with the coordinates of the nodes
+    and the length, maximum speed (km/h) and name (if any) of the edges. If the compiled graph has congestions,
+    they are inserted too."""
+
+    graph = nx.DiGraph(crs='epsg:4326')
+    nodes = cgraph.nodes.tolist()
+    graph.add_nodes_from((node, {'x': x, 'y': y}) for node, x, y in zip(nodes, cgraph.x.tolist(), cgraph.y.tolist()))
+    graph.add_edges_from((nodes[node_u], nodes[node_v], {'length': length, 'maxspeed': f'{maxspeed*3.6:g}'})
+                         for node_u, node_v, length, maxspeed in zip(cgraph.sources.tolist(), cgraph.targets.tolist(),
+                                                                     cgraph.length_list, cgraph.maxspeed.tolist()))
+    for node_u, node_v, name in zip(cgraph.sources.tolist(), cgraph.targets.tolist(), cgraph.name.tolist()):
+        if name != -1:
+            graph[nodes[node_u]][nodes[node_v]]['name'] = cgraph.names[name]
+    if cgraph.epoch != 0:
+        export_compiled_igraph(cgraph, graph)
+
+    return graph
+
+
+# iGraph snapshot
+def save_igraph_snapshot(cgraph, congestions_list, download_datetime, snapshot_filename):
+    """Method that saves a snapshot of a built compiled igraph (see 'build_compiled_igraph') in the binary format, with
+    the filename (or path) passed as a parameter, so that the bot can answer with it as soon as it is restarted.
+    The congestions dictionary used to build it and the datetime when they were downloaded are saved with it
+    (the snapping index is already saved on its own, see 'get_snapping_index').
+    The compiled igraph is not changed, as it may be in use while it is saved."""
+
+    metadata = {'congestions': {way_id: [congestion.current, congestion.future, None if congestion.date == None else congestion.date.isoformat()]
+                                for way_id, congestion in congestions_list.items()},
+                'download_datetime': download_datetime.isoformat()}
+    save_compiled_graph(cgraph, snapshot_filename, metadata)
+
+
+def load_igraph_snapshot(snapshot_filename):
+    """Method that returns the compiled igraph, the congestions dictionary and the datetime when they were downloaded
+    saved as a snapshot with the given filename (or path) (see 'save_igraph_snapshot').
+    If there is no valid snapshot, returns None."""
+
+    if not exists_graph(snapshot_filename):
+        return None
+    try:
+        cgraph = load_compiled_graph(snapshot_filename)
+        congestions_list = {int(way_id): (Congestion)(current, future, None if date == None else datetime.fromisoformat(date))
+                            for way_id, (current, future, date) in cgraph.metadata['congestions'].items()}
+        download_datetime = datetime.fromisoformat(cgraph.metadata['download_datetime'])
+    except: # Not a snapshot.
+        return None
+
+    return cgraph, congestions_list, download_datetime
+
+
+# Refresh
+def refresh_igraph_copy(igraph, cgraph, highways_list, congestions_list, snapping_index):
+    """Method that builds the igraph and compiled igraph with a new congestions dictionary on copies of the given ones,
+    which are not changed and can still be used meanwhile. Returns the new ones, which can replace the old ones at once."""
+
+    new_cgraph = cgraph.copy()
+    changed_edges = build_compiled_igraph(new_cgraph, highways_list, congestions_list, snapping_index)
+    new_igraph = export_compiled_igraph(new_cgraph, igraph.copy(), changed_edges)
+
+    return new_igraph, new_cgraph
+
+
+class RefreshScheduler(threading.Thread):
+    """Class that represents a thread that calls a refresh function every 'interval' seconds on its own, so that
+    nobody waiting for an answer has to wait for a refresh. If the refresh function fails, the error is printed
+    and it is called again in the next interval."""
+
+    def __init__(self, interval, refresh, run_now=False):
+        """Creates the scheduler (it starts with 'start'). If run_now=True, the first refresh is done as soon as it starts."""
+
+        threading.Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self.refresh = refresh
+        self.run_now = run_now
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Method that calls the refresh function every interval until the scheduler is stopped."""
+
+        if not self.run_now:
+            self.stopped.wait(self.interval)
+        while not self.stopped.is_set():
+            try: self.refresh()
+            except Exception as error:
+                print(f"Unable to refresh: {error}")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        """Method that stops the scheduler after the current refresh."""
+
+        self.stopped.set()
+
 
 #iPath
 def get_k_shortest_paths_with_itime(igraph, node_origin, node_destination, k, current):
@@ -400,15 +1968,16 @@ def get_k_shortest_paths_with_itime(igraph, node_origin, node_destination, k, cu
         key = 'current_itime'
     else:
         key = 'future_itime'
-    try: nx.algorithms.simple_paths.shortest_simple_paths(igraph, node_origin, node_destination, weight=key)
-    except:
-        print("Unable to find paths to destination.")
     generator = nx.algorithms.simple_paths.shortest_simple_paths(igraph, node_origin, node_destination, weight=key)
     ipaths = []
-    for counter, path in enumerate(generator): # Get only the first k paths, which will be the shortest ones.
-        ipaths.append(path)
-        if counter == k-1:
-            break
+    try:
+        for counter, path in enumerate(generator): # Get only the first k paths, which will be the shortest ones.
+            ipaths.append(path)
+            if counter == k-1:
+                break
+    except:
+        print("Unable to find paths to destination.")
+        raise
 
     return ipaths # Returns a list of paths, where every path is a list of nodes.
 
@@ -423,19 +1992,446 @@ def get_shortest_path_with_itime(igraph, node_origin, node_destination, current)
         key = 'current_itime'
     else:
         key = 'future_itime'
-    try: ox.distance.shortest_path(igraph, node_origin, node_destination, weight=key)
+    try: return ox.distance.shortest_path(igraph, node_origin, node_destination, weight=key) # The shortest path is a list of node ids.
     except:
         print("Unable to find a path to destination.")
+        raise
+
+
+class RouteCache:
+    """Class that represents a bounded cache of the routes found by 'plan_route', with least recently used eviction.
+    Routes are kept by origin and destination OSM nodes, number of paths and 'epoch' of the compiled igraph, so a route
+    is never used after congestions change: all routes of previous epochs are removed as soon as a new epoch is seen.
+    Epochs only grow, so routes of an older epoch (found with data got just before a refresh) are neither used nor kept.
+    It counts its 'hits', 'misses' and 'evictions', and can be used by several threads at the same time."""
+
+    def __init__(self, size):
+        """Creates an empty cache that keeps at most 'size' routes."""
+
+        self.size = size
+        self.routes = collections.OrderedDict()
+        self.epoch = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, epoch):
+        """Method that returns the route cached with the given key in the given epoch, or None if there is not any."""
+
+        with self.lock:
+            if not self.__check_epoch(epoch) or key not in self.routes:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.routes.move_to_end(key) # Most recently used route.
+            return self.routes[key]
+
+    def put(self, key, epoch, route):
+        """Method that caches a route with the given key in the given epoch, evicting the least recently used one if full."""
+
+        with self.lock:
+            if not self.__check_epoch(epoch):
+                return
+            self.routes[key] = route
+            self.routes.move_to_end(key)
+            if len(self.routes) > self.size:
+                self.routes.popitem(last=False)
+                self.evictions += 1
+
+    def __check_epoch(self, epoch):
+        """Private method that removes all cached routes if the given epoch is newer than the one they were found in.
+        Returns whether routes of the given epoch can be cached, which they can not if it is older."""
+
+        if self.epoch == None or epoch > self.epoch:
+            self.routes.clear()
+            self.epoch = epoch
+        return epoch == self.epoch
+
+
+def plan_route(igraph, cgraph, origin, destination, k=3, cache=None, spatial_index=None):
+    """Method that, given an igraph and its compiled version, an origin Location and a destination Location, finds the
+    best path and k alternative paths between them doing every search only once, and returns them in a Route tuple:
+    the OSM nodes where origin and destination are snapped (only once), the two parts of the best path
+    (see 'get_time_dependent_shortest_path'), the alternative paths, the 'eta' (seconds to get to destination)
+    and the 'failure' reason, which is None if paths are found.
+    The shortest path with current itimes (looked for with bidirectional A*, see '__compiled_bidirectional_astar')
+    is shared: it is the first alternative path and, if it arrives before 'FUTURE_CONGESTION_TIME', the best path too.
+    Otherwise, the best path is found with a single time-dependent search.
+    If a RouteCache is given, routes between the same nodes with the same congestions are not looked for again.
+    If the spatial index of the graph is given, it is used to snap the Locations (see 'build_spatial_index')."""
+
+    if spatial_index != None:
+        node_origin, node_destination = spatial_index.nearest_nodes([origin.lng, destination.lng], [origin.lat, destination.lat])
+    else:
+        node_origin = ox.distance.nearest_nodes(igraph, origin.lng, origin.lat)
+        node_destination = ox.distance.nearest_nodes(igraph, destination.lng, destination.lat)
+    if cache != None:
+        route = cache.get((node_origin, node_destination, k), cgraph.epoch)
+        if route != None:
+            return route
+    route = __find_route(cgraph, node_origin, node_destination, k)
+    if cache != None:
+        cache.put((node_origin, node_destination, k), cgraph.epoch, route)
+
+    return route
+
+
+def __find_route(cgraph, node_origin, node_destination, k):
+    """Private method that finds the route between two OSM nodes as explained in 'plan_route'."""
+
+    source, target = cgraph.index[node_origin], cgraph.index[node_destination]
+    try:
+        path, time = __compiled_bidirectional_astar(cgraph, source, target, cgraph.itimes(True))
+        if time == float('inf'):
+            raise nx.NetworkXNoPath(f"No path to {target}.") # Only closed roads get to destination.
+        if time <= FUTURE_CONGESTION_TIME:
+            current_path, future_path, eta = cgraph.to_osm_path(path), [], time
+        else:
+            best_path, arrivals = __compiled_time_dependent_dijkstra(cgraph, source, target)
+            current_path, future_path = __split_time_dependent_path(cgraph, best_path, arrivals)
+            eta = arrivals[-1]
+    except nx.NetworkXNoPath:
+        return Route(node_origin, node_destination, [], [], [], None, 'Unable to find a path to destination.')
+    alternative_paths = get_alternative_paths_with_itime(cgraph, node_origin, node_destination, k, current=True, shortest_path=path)
+
+    return Route(node_origin, node_destination, current_path, future_path, alternative_paths, eta, None)
+
+
+def __maneuver(bearing_before, bearing_after):
+    """Private method that returns the maneuver to go from a way with a bearing (degrees) to another one."""
+
+    turn = (bearing_after - bearing_before + 180) % 360 - 180 # From -180 (left) to 180 (right).
+    side = 'right' if turn > 0 else 'left'
+    if abs(turn) < 20:
+        return 'Continue'
+    if abs(turn) < 60:
+        return f'Slight {side}'
+    if abs(turn) < 135:
+        return f'Turn {side}'
+    if abs(turn) < 170:
+        return f'Sharp {side}'
+    return 'U-turn'
+
+
+def get_route_directions(cgraph, route):
+    """Method that returns the distance (meters) of the best path of a Route (see 'plan_route') and its directions:
+    a list of Steps with the 'maneuver' to get into every street of the path (the first one is 'Head'), the name of the
+    'street' (None if it has no name) and the 'distance' (meters) driven on it. Consecutive edges with the same name are
+    a single step, and the maneuver is given by the bearings of the edges before and after the change of street."""
+
+    path = [cgraph.index[node] for node in route.current_path + route.future_path[1:]]
+    steps = []
+    bearing_before = None
+    for edge in cgraph.path_edges(path):
+        node_u, node_v = cgraph.sources_list[edge], cgraph.targets_list[edge]
+        dx = (cgraph.x[node_v] - cgraph.x[node_u]) * math.cos(math.radians(cgraph.y[node_u]))
+        bearing = math.degrees(math.atan2(dx, cgraph.y[node_v] - cgraph.y[node_u])) # Clockwise from north.
+        street = None if cgraph.name[edge] == -1 else cgraph.names[cgraph.name[edge]]
+        length = float(cgraph.length[edge])
+        if len(steps) != 0 and steps[-1].street == street:
+            steps[-1] = steps[-1]._replace(distance=steps[-1].distance+length)
+        else:
+            maneuver = 'Head' if bearing_before == None else __maneuver(bearing_before, bearing)
+            steps.append(Step(maneuver, street, length))
+        bearing_before = bearing
+
+    return sum(step.distance for step in steps), steps
+
+
+# Geocoding
+STREET_TYPES = ['carrer', 'calle', 'c', 'avinguda', 'avenida', 'av', 'avda', 'passeig', 'paseo', 'pg', 'placa', 'plaza', 'pl',
+                'rambla', 'ronda', 'gran via', 'via', 'travessera', 'travessia', 'passatge', 'pasaje', 'ptge', 'cami', 'camino',
+                'baixada', 'pujada', 'moll', 'rbla']
+ARTICLES = ['de', 'del', 'dels', 'la', 'les', 'el', 'l', 'd'] # Normalized words left out when street names are compared.
+# Abbreviated street types, written in full when street names are compared with their street type.
+STREET_TYPE_ABBREVIATIONS = {'c': 'carrer', 'av': 'avinguda', 'avda': 'avinguda', 'pg': 'passeig', 'pl': 'placa',
+                             'ptge': 'passatge', 'rbla': 'rambla'}
+
+
+class Gazetteer:
+    """Class that represents an offline gazetteer of the streets of a compiled graph, built from the name of its edges,
+    to get the Location of a street without any remote geocoder.
+    Every street is located at the middle point of the edge of the street nearest to the center of all of them.
+    Names are looked for without accents, punctuation nor case: first the whole name, then the name without articles
+    but with its street type (as 'Plaça Catalunya' for 'Plaça de Catalunya'), then the name without the street type
+    (as 'Carrer de'), then the streets that start with the whole name or the name without the street type and finally
+    the most similar one.
+    A street is only returned if it is the only one found in that step (as 'Catalunya' may be 'Plaça de Catalunya' or
+    'Rambla de Catalunya'), so that ambiguous places are looked for with the geocoder instead (see 'geocode')."""
+
+    def __init__(self, cgraph, cutoff=0.85):
+        """Creates the gazetteer of the streets of the compiled graph. Similar names are only accepted if their
+        similarity (from 0 to 1) is at least 'cutoff'."""
+
+        self.cutoff = cutoff
+        self.names = {} # Normalized whole name to Location.
+        self.typed_names = {} # Normalized name without articles to Location (None if more than one street has it).
+        self.cores = {} # Normalized name without street type to Location (None if more than one street has it).
+        edges = np.flatnonzero(cgraph.name != -1)
+        edges = edges[np.argsort(cgraph.name[edges], kind='stable')]
+        middle_x = (cgraph.x[cgraph.sources[edges]] + cgraph.x[cgraph.targets[edges]]) / 2
+        middle_y = (cgraph.y[cgraph.sources[edges]] + cgraph.y[cgraph.targets[edges]]) / 2
+        starts = np.flatnonzero(np.diff(cgraph.name[edges], prepend=-1)) # First edge of every name.
+        for start, end in zip(starts.tolist(), starts[1:].tolist() + [len(edges)]):
+            x, y = middle_x[start:end], middle_y[start:end]
+            nearest = int(np.argmin((x - x.mean())**2 + (y - y.mean())**2)) # Edge nearest to the center of the street.
+            location = (Location) (float(x[nearest]), float(y[nearest]))
+            name = cgraph.names[cgraph.name[edges[start]]]
+            normalized = self.__normalize(name)
+            if normalized in self.names:
+                continue # Same name written in another way.
+            self.names[normalized] = location
+            typed_name = self.__typed_name(normalized)
+            self.typed_names[typed_name] = location if typed_name not in self.typed_names else None
+            core = self.__core(normalized)
+            self.cores[core] = location if core not in self.cores else None
+        self.sorted_names = sorted(self.names) # To find the streets that start with a name.
+        self.sorted_cores = sorted(self.cores)
+
+    def __normalize(self, name):
+        """Returns the name in lowercase, without accents and with words separated by a single space."""
+
+        name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+        return ' '.join(re.findall(r'[a-z0-9]+', name))
+
+    def __typed_name(self, name):
+        """Returns a normalized name without articles (see 'ARTICLES') and with its street type written in full
+        (see 'STREET_TYPE_ABBREVIATIONS'), so that the street type still tells apart streets with the same name."""
+
+        words = [word for word in name.split(' ') if word not in ARTICLES]
+        if len(words) != 0:
+            words[0] = STREET_TYPE_ABBREVIATIONS.get(words[0], words[0])
+
+        return ' '.join(words)
+
+    def __core(self, name):
+        """Returns a normalized name without the street type and articles at its beginning (see 'STREET_TYPES')."""
+
+        removed = True
+        while removed:
+            removed = False
+            for street_type in STREET_TYPES + ARTICLES:
+                if name.startswith(street_type + ' '):
+                    name = name[len(street_type)+1:]
+                    removed = True
+
+        return name
+
+    def lookup(self, place):
+        """Returns the Location of the street with the given name, or None if there is no such street or there are
+        many of them. Places with numbers (as addresses) are not looked for, as only whole streets are known."""
+
+        name = self.__normalize(place)
+        if name == '' or re.search(r'[0-9]', name):
+            return None
+        if name in self.names:
+            return self.names[name]
+        typed_name = self.__typed_name(name)
+        if typed_name in self.typed_names:
+            return self.typed_names[typed_name] # None if ambiguous.
+        core = self.__core(name)
+        if core in self.cores:
+            return self.cores[core] # None if ambiguous.
+        for prefix, sorted_names, locations in [(name, self.sorted_names, self.names), (core, self.sorted_cores, self.cores)]:
+            if len(prefix) < 4:
+                continue
+            position = bisect.bisect_left(sorted_names, prefix)
+            matches = [found for found in sorted_names[position:position+2] if found.startswith(prefix)]
+            if len(matches) == 1: # Only one street starts with the name.
+                return locations[matches[0]]
+            if len(matches) > 1: # Many streets start with the name.
+                return None
+        similar = difflib.get_close_matches(core, self.sorted_cores, n=2, cutoff=self.cutoff)
+        if len(similar) == 1:
+            return self.cores[similar[0]]
+
+        return None
+
+
+class GeocodeCache:
+    """Class that represents a cache of the Locations got from a remote geocoder, saved in a file (if given) so that
+    they are kept when the bot is restarted. Places that could not be found are cached too. Every Location
+    is only used for 'ttl' seconds after it was got. It can be used by many threads at once."""
+
+    def __init__(self, filename=None, ttl=30*24*3600):
+        """Creates the cache, with the Locations already saved in the file."""
+
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.locations = {} # Place to the Location (or None) and the time when it was got.
+        if filename != None and os.path.exists(filename):
+            try:
+                with open(filename) as file:
+                    self.locations = {place: (None if location == None else (Location)(*location), saved)
+                                      for place, (location, saved) in json.load(file).items()}
+            except ValueError: # Not a geocode cache.
+                self.locations = {}
+
+    def get(self, place):
+        """Returns whether the place is cached and its Location (None if it could not be found)."""
+
+        with self.lock:
+            if place not in self.locations:
+                return False, None
+            location, saved = self.locations[place]
+            if time.time() - saved > self.ttl: # Expired.
+                del self.locations[place]
+                return False, None
+            return True, location
+
+    def put(self, place, location):
+        """Caches the Location (None if it could not be found) of the place and saves the cache."""
+
+        with self.lock:
+            self.locations[place] = (location, time.time())
+            if self.filename != None:
+                with open(self.filename + '.tmp', 'w') as file:
+                    json.dump({place: (None if location == None else list(location), saved)
+                               for place, (location, saved) in self.locations.items()}, file)
+                os.replace(self.filename + '.tmp', self.filename)
+
+
+def geocode(place, city, gazetteer=None, cache=None):
+    """Method that returns the Location of a place of the given city, or None if it can not be found.
+    The place is looked for in the Gazetteer of the streets of the graph (if given), then in the GeocodeCache
+    (if given) and, only if it is not there, with the Nominatim geocoder of OSMnx, whose result is cached.
+    Network errors are raised and not cached."""
+
+    if gazetteer != None:
+        location = gazetteer.lookup(place)
+        if location != None:
+            return location
+    key = ' '.join(place.lower().split())
+    if cache != None:
+        cached, location = cache.get(key)
+        if cached:
+            return location
+    try:
+        lat, lng = ox.geocoder.geocode(f'{place}, {city}')
+        location = (Location) (lng, lat)
+    except OSError: # Network error.
+        raise
+    except Exception: # Place not found.
+        location = None
+    if cache != None:
+        cache.put(key, location)
+
+    return location
+
+
+# Routing pool
+class RoutingPool:
+    """Class that represents a pool of worker processes that find routes (see 'start_routing_pool').
+    Every worker memory-maps the snapshot of the compiled igraph (see 'save_igraph_snapshot'), so all of them share
+    its arrays, and maps it again when the 'generation' of the pool is increased by 'update_routing_pool'.
+    Only the arrays are shared: every worker still builds its own Python lists of the graph structure and index of
+    OSM ids (see 'CompiledGraph'), which searches need."""
+
+    def __init__(self, executor, snapshot_filename):
+        """Creates the pool with the executor of its worker processes and the filename of the snapshot they map."""
+
+        self.executor = executor
+        self.snapshot_filename = snapshot_filename
+        self.generation = 0
+
+
+__worker_state = {} # Compiled igraph mapped by a routing worker process, its generation and the warm-up barrier.
+WORKERS_TIMEOUT = 60 # Seconds to wait for all routing worker processes to be started (see 'start_routing_pool').
+
+
+def start_routing_pool(processes, snapshot_filename):
+    """Method that starts and returns a RoutingPool with the given number of worker processes, which find routes
+    with the compiled igraph saved as a snapshot with the given filename (or path).
+    Unlike threads, worker processes find routes at the same time, so throughput grows with the number of cores.
+    Workers are forked, so the pool needs to be started before any other thread (and before big data is loaded),
+    and it can not be started where the fork start method is not available (a ValueError is raised).
+    To make sure all of them are forked now, as many tasks as workers are run, each of them waiting for all the others
+    at a barrier, so no worker can run two of them."""
+
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(processes)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                                      initializer=__start_worker, initargs=(barrier,))
+    warm_ups = [executor.submit(__warm_up_worker) for i in range(processes)]
+    for warm_up in warm_ups:
+        warm_up.result()
+    return RoutingPool(executor, snapshot_filename)
+
+
+def __start_worker(barrier):
+    """Private method run by every routing worker process when it is started, that keeps the warm-up barrier."""
+
+    __worker_state['barrier'] = barrier
+
+
+def __warm_up_worker():
+    """Private method run by a routing worker process that waits until all routing workers are running it
+    (see 'start_routing_pool')."""
+
+    __worker_state['barrier'].wait(WORKERS_TIMEOUT)
+
+
+def update_routing_pool(pool):
+    """Method that makes the workers of a RoutingPool map the snapshot again before finding their next route.
+    It needs to be called every time a new snapshot is saved."""
+
+    pool.generation += 1
+
+
+def stop_routing_pool(pool):
+    """Method that stops the worker processes of a RoutingPool."""
+
+    pool.executor.shutdown()
+
+
+def __route_in_worker(snapshot_filename, generation, node_origin, node_destination, k):
+    """Private method run by a routing worker process that finds the route between two OSM nodes (see 'plan_route')
+    with the compiled igraph of the snapshot, which is mapped again if the generation of the pool has changed."""
 
-    return ox.distance.shortest_path(igraph, node_origin, node_destination, weight=key) # The shortest path is a list of node ids.
+    if __worker_state.get('generation') != generation:
+        __worker_state['cgraph'] = load_compiled_graph(snapshot_filename)
+        __worker_state['generation'] = generation
 
+    return __find_route(__worker_state['cgraph'], node_origin, node_destination, k)
 
-def __get_3_best_ipaths(igraph, origin, destination):
+
+def plan_route_in_pool(pool, cgraph, spatial_index, origin, destination, k=3, cache=None):
+    """Method that finds a route as 'plan_route' does, but the search is done by a worker process of a RoutingPool.
+    Locations are snapped with the spatial index and the RouteCache, if given, is looked at before, in this process,
+    with the epoch of the given compiled igraph (the one saved in the last snapshot).
+    If the pool is broken (a worker process died), the route is found in this process with the given compiled igraph."""
+
+    node_origin, node_destination = spatial_index.nearest_nodes([origin.lng, destination.lng], [origin.lat, destination.lat])
+    if cache != None:
+        route = cache.get((node_origin, node_destination, k), cgraph.epoch)
+        if route != None:
+            return route
+    try:
+        future = pool.executor.submit(__route_in_worker, pool.snapshot_filename, pool.generation, node_origin, node_destination, k)
+        route = future.result()
+    except concurrent.futures.process.BrokenProcessPool: # The pool can not be used anymore.
+        route = __find_route(cgraph, node_origin, node_destination, k)
+    if cache != None:
+        cache.put((node_origin, node_destination, k), cgraph.epoch, route)
+
+    return route
+
+
+def __get_3_best_ipaths(igraph, origin, destination, cgraph=None):
     """Private method that, given a graph, an origin Location and a destination Location, finds the 3 best paths
     from origin node to destination node in the graph using 'itime' attributes.
     With the best shortest path, the path will be calculated using both current and future itimes, depending if the total time
-    of the path arrives to 15 minutes in some point of it (as future congestion information referrs to congestion in 15 minutes)."""
-
+    of the path arrives to 15 minutes in some point of it (as future congestion information referrs to congestion in 15 minutes).
+    If the compiled version of the igraph (see 'compile_igraph') is given, paths are found with 'plan_route' instead.
+    If no path is found, a networkx.NetworkXNoPath exception is raised."""
+
+    if cgraph != None:
+        route = plan_route(igraph, cgraph, origin, destination)
+        if route.failure != None:
+            raise nx.NetworkXNoPath(route.failure)
+        return route.current_path, route.future_path, route.alternative_paths
     node_origin = ox.distance.nearest_nodes(igraph, origin.lng, origin.lat)
     node_destination = ox.distance.nearest_nodes(igraph, destination.lng, destination.lat)
     # Get best shortest path with current itime attribute.
@@ -493,14 +2489,15 @@ def __draw_path(igraph, map, path, color, width, key):
             first = False
 
 
-def plot_k_ipaths(igraph, best_ipath_current, best_ipath_future, alternative_ipaths_list, ipath_png, size):
+def plot_k_ipaths(igraph, best_ipath_current, best_ipath_future, alternative_ipaths_list, ipath_png, size, image_format=None, quality=85):
     """Method that, given a graph, the part of the best path calculated with the current itime and the one
     with the future itime, and a list of alternative paths, plots them into a map.
     The map is created with StaticMap and has a size defined by a given parameter.
-    Once all lines are drawn, the map is saved into a location passed as a parameter."""
+    Once all lines are drawn, the map is saved into a location passed as a parameter or, if it is None,
+    returned as the bytes of the image encoded with the given format and quality (see 'save_image')."""
 
     # Draw alternative ipaths
-    map = StaticMap(size, size)
+    map = new_static_map(size, size)
     for path in alternative_ipaths_list:
         __draw_path(igraph, map, path, 'SlateGray', 4, None) # Draw the alternative path with grey color.
     # Draw main ipath
@@ -518,4 +2515,38 @@ def plot_k_ipaths(igraph, best_ipath_current, best_ipath_future, alternative_ipa
     map.add_marker(destination)
 
     image = map.render()
-    image.save(ipath_png)
+    return save_image(image, ipath_png, image_format, quality)
+
+
+# Render queue
+class RenderQueue:
+    """Class that represents a queue of renders (any method with its arguments, as one that plots and sends a map)
+    done in the background by a fixed number of threads, so that a burst of renders does not slow down everything else.
+    At most 'size' renders can be waiting: when the queue is full, new renders are rejected."""
+
+    def __init__(self, threads=2, size=32):
+        """Creates the queue and starts its threads."""
+
+        self.queue = queue.Queue(maxsize=size)
+        for i in range(threads):
+            threading.Thread(target=self.__run, daemon=True).start()
+
+    def submit(self, render, *args):
+        """Adds a render to the queue. Returns False if the queue is full, so the render will not be done."""
+
+        try:
+            self.queue.put_nowait((render, args))
+        except queue.Full:
+            return False
+        return True
+
+    def __run(self):
+        """Does the renders of the queue one after another."""
+
+        while True:
+            render, args = self.queue.get()
+            try:
+                render(*args)
+            except Exception as error: # A failed render does not stop the thread.
+                print(f'Unable to render: {error}')
+            self.queue.task_done()
@@ -0,0 +1,85 @@
+# test_igraph.py
+
+"""test_igraph.py
+
+The test_igraph.py python file checks that 'update_igraph' of the 'iGo.py' module gets the same congestions and itimes
+as a full build of the compiled igraph ('build_compiled_igraph') on a synthetic city (see 'benchmark.synthetic_graph'),
+refreshed several times with new congestions.
+Run it with: python -m unittest test_igraph"""
+
+# authors: Héctor Fortuño and Ramon Ventura
+
+import unittest
+import numpy as np
+import iGo
+import benchmark
+
+SIZE = 30 # Intersections of every side of the synthetic city.
+REFRESHES = 3
+KEYS = ['current_congestion', 'future_congestion', 'current_itime', 'future_itime']
+
+
+def snap_highways(graph, highways_list):
+    """Method that returns the snapping index (see 'iGo.build_snapping_index') of the synthetic highways, whose
+    consecutive Locations are next to consecutive intersections of the same street, without looking for paths."""
+
+    spatial_index = iGo.build_spatial_index(graph)
+    edges = {}
+    for way_id, way in highways_list.items():
+        nodes = spatial_index.nearest_nodes([location.lng for location in way], [location.lat for location in way])
+        edges[way_id] = []
+        for node_u, node_v in zip(nodes[:-1], nodes[1:]):
+            if graph.has_edge(node_u, node_v):
+                edges[way_id].append((node_u, node_v))
+            elif graph.has_edge(node_v, node_u): # One-way street given reversed.
+                edges[way_id].append((node_v, node_u))
+
+    return {'hash': None, 'edges': edges}
+
+
+class UpdateIgraphTest(unittest.TestCase):
+    """Tests of the update of an igraph with new congestions (see 'iGo.update_igraph')."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Creates a synthetic city, its highways and a sequence of congestions, each one changing some highways."""
+
+        cls.graph = benchmark.synthetic_graph(SIZE)
+        cls.highways = benchmark.synthetic_highways(cls.graph, SIZE)
+        cls.snapping_index = snap_highways(cls.graph, cls.highways)
+        cls.congestions = [benchmark.synthetic_congestions(cls.highways)]
+        for refresh in range(1, REFRESHES + 1):
+            cls.congestions.append(benchmark.synthetic_congestions(cls.highways, seed=refresh, changed=cls.congestions[-1]))
+
+    def __build(self, congestions_list):
+        """Returns the compiled igraph built from scratch with the given congestions and its exported igraph."""
+
+        cgraph = iGo.compile_igraph(self.graph)
+        iGo.build_compiled_igraph(cgraph, self.highways, congestions_list, self.snapping_index)
+
+        return cgraph, iGo.export_compiled_igraph(cgraph, self.graph.copy())
+
+    def test_same_as_full_build(self):
+        """After every refresh, the updated igraph and compiled igraph are the same as the ones built from scratch."""
+
+        cgraph, igraph = self.__build(self.congestions[0])
+        for old_congestions, new_congestions in zip(self.congestions[:-1], self.congestions[1:]):
+            iGo.update_igraph(igraph, old_congestions, new_congestions, self.snapping_index, cgraph)
+            expected_cgraph, expected_igraph = self.__build(new_congestions)
+            for key in KEYS:
+                np.testing.assert_allclose(getattr(cgraph, key), getattr(expected_cgraph, key), err_msg=key)
+                self.assertEqual([igraph[node_u][node_v][key] for node_u, node_v in self.graph.edges()],
+                                 [expected_igraph[node_u][node_v][key] for node_u, node_v in self.graph.edges()], key)
+
+    def test_unchanged_congestions(self):
+        """Nothing changes if the congestions are the same."""
+
+        cgraph, igraph = self.__build(self.congestions[0])
+        expected = {key: np.array(getattr(cgraph, key)) for key in KEYS}
+        iGo.update_igraph(igraph, self.congestions[0], self.congestions[0], self.snapping_index, cgraph)
+        for key in KEYS:
+            np.testing.assert_array_equal(getattr(cgraph, key), expected[key], err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# test_routing.py
+
+"""test_routing.py
+
+The test_routing.py python file checks the bidirectional A* search of the compiled igraph of the 'iGo.py' module
+against Dijkstra algorithm on a synthetic city (see 'benchmark.synthetic_graph').
+Run it with: python -m unittest test_routing"""
+
+# authors: Héctor Fortuño and Ramon Ventura
+
+import random
+import unittest
+import numpy as np
+import iGo
+import benchmark
+
+SIZE = 40 # Intersections of every side of the synthetic city.
+QUERIES = 100
+
+# Private methods of the iGo module (module names are not mangled, but names used in a class are).
+compiled_dijkstra = getattr(iGo, '__compiled_dijkstra')
+compiled_bidirectional_astar = getattr(iGo, '__compiled_bidirectional_astar')
+
+
+class BidirectionalAstarTest(unittest.TestCase):
+    """Tests of the bidirectional A* search (see 'iGo.__compiled_bidirectional_astar')."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Compiles a synthetic city with random congestions, some roads closed, and random queries."""
+
+        cls.cgraph = iGo.compile_igraph(benchmark.synthetic_graph(SIZE))
+        congestions = np.random.default_rng(0).choice([1, 2, 2, 3, 4, 5, 6], size=len(cls.cgraph.targets)).astype(np.float64)
+        cls.cgraph.set_congestions(slice(None), congestions, True)
+        cls.weights = cls.cgraph.current_itime.tolist()
+        rng = random.Random(0)
+        cls.queries = [(rng.randrange(len(cls.cgraph.nodes)), rng.randrange(len(cls.cgraph.nodes))) for i in range(QUERIES)]
+
+    def __search(self, method, source, target, settled):
+        """Returns the path and itime found by a search method, or (None, None) if there is no path."""
+
+        try:
+            return method(self.cgraph, source, target, self.weights, settled=settled)
+        except iGo.nx.NetworkXNoPath:
+            return None, None
+
+    def test_same_itime_as_dijkstra(self):
+        """The path found has the itime of the one found by Dijkstra algorithm, and it is a path of the graph."""
+
+        for source, target in self.queries:
+            _, itime = self.__search(compiled_dijkstra, source, target, None)
+            path, astar_itime = self.__search(compiled_bidirectional_astar, source, target, None)
+            if itime == None:
+                self.assertIsNone(astar_itime)
+                continue
+            self.assertAlmostEqual(astar_itime, itime, places=6)
+            self.assertEqual((path[0], path[-1]), (source, target))
+            self.assertAlmostEqual(sum(self.weights[self.cgraph.edge(node_u, node_v)] for node_u, node_v in zip(path[:-1], path[1:])), itime, places=6)
+
+    def test_source_is_target(self):
+        """The path from a node to itself is only the node, with no itime, as Dijkstra algorithm finds."""
+
+        for node in [0, len(self.cgraph.nodes)//2, len(self.cgraph.nodes) - 1]:
+            self.assertEqual(self.__search(compiled_dijkstra, node, node, None), ([node], 0))
+            self.assertEqual(self.__search(compiled_bidirectional_astar, node, node, None), ([node], 0))
+    def test_settles_fewer_nodes_than_dijkstra(self):
+        """Both searches together settle much fewer nodes than Dijkstra algorithm."""
+
+        dijkstra_settled, astar_settled = 0, 0
+        for source, target in self.queries:
+            settled = set()
+            self.__search(compiled_dijkstra, source, target, settled)
+            dijkstra_settled += len(settled)
+            settled = [set(), set()]
+            self.__search(compiled_bidirectional_astar, source, target, settled)
+            astar_settled += len(settled[0]) + len(settled[1])
+        self.assertLess(astar_settled, 0.6*dijkstra_settled)
+
+
+if __name__ == '__main__':
+    unittest.main()